@@ -0,0 +1,227 @@
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+from Handlers import handler_for, warm_up_ocr
+from chatGPT import SummaryService
+from Database.DBHandler import DatabaseManager
+from Database.CacheHandler import ResultCache
+from Database.JobQueue import JobQueue
+from Pipeline import DocumentPipeline
+
+EXIT_MAX_RSS = 3   # stopped by the memory guard, a rerun continues
+
+
+def walk(root):
+    """
+    Yield the supported files below root, directories in sorted order so
+    reruns see the files in the same order.
+    """
+    for directory, directories, files in os.walk(root):
+        directories.sort()
+        for filename in sorted(files):
+            path = os.path.abspath(os.path.join(directory, filename))
+            if handler_for(path) is not None:
+                yield path
+
+
+def known_links(db_directory):
+    """links of the documents stored already, read without creating the database"""
+    db_file = os.path.join(db_directory, "Documents.db")
+    if not os.path.exists(db_file):
+        return set()
+    connection = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        return {row[0] for row in connection.execute("SELECT link_original FROM documents;")}
+    except sqlite3.OperationalError:
+        return set()
+    finally:
+        connection.close()
+
+
+def rss_mb():
+    """resident memory of this process and its extraction workers"""
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    for pid in [os.getpid()] + [child.pid for child in multiprocessing.active_children()]:
+        try:
+            with open(f"/proc/{pid}/statm") as file:
+                total += int(file.read().split()[1]) * page_size
+        except (OSError, ValueError, IndexError):
+            if pid == os.getpid():
+                # no procfs, the peak of this process is the best we know
+                total += resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return total / (1024 * 1024)
+
+
+class Progress:
+    """reports the state of the backfill from a daemon thread every interval seconds"""
+
+    def __init__(self, pipeline, interval=10.0):
+        self.pipeline = pipeline
+        self.interval = interval
+        self.walked = 0
+        self.skipped = 0
+        self.submitted = 0
+        self.walk_finished = False
+        self.started = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="backfill-progress", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.report()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def report(self):
+        finished = self.pipeline.finished_counts()
+        done = sum(finished.values())
+        elapsed = time.monotonic() - self.started
+        rate = done / elapsed * 60 if elapsed else 0.0
+        total = f"{self.submitted}" if self.walk_finished else f"{self.submitted}+"
+        eta = ""
+        if self.walk_finished and rate:
+            eta = f", about {(self.submitted - done) / rate:.0f} min left"
+        logging.info(f"backfill {done}/{total} documents {finished}, {self.skipped} of {self.walked} files known, "
+                     f"{rate:.1f} docs/min, rss {rss_mb():.0f} MB{eta}")
+
+
+def dry_run(root, db_directory):
+    """print what a backfill would do, nothing is extracted or written"""
+    known = known_links(db_directory)
+    counts = {}
+    new_files = 0
+    new_bytes = 0
+    for path in walk(root):
+        extension = os.path.splitext(path)[1].lower()
+        counts[extension] = counts.get(extension, 0) + 1
+        if path not in known:
+            new_files += 1
+            new_bytes += os.path.getsize(path)
+    print(f"files per format: {counts}")
+    print(f"{sum(counts.values()) - new_files} already stored, {new_files} to ingest ({new_bytes / 1e6:.1f} MB)")
+    return 0
+
+
+def wait_for_memory(pipeline, max_rss):
+    """
+    Hold the intake while the memory is above max_rss and let the documents in
+    flight drain. :return: False if the limit still holds with nothing in flight
+    """
+    if not max_rss or rss_mb() <= max_rss:
+        return True
+    logging.warning(f"rss above {max_rss} MB, pausing the intake")
+    while pipeline.in_flight():
+        time.sleep(0.5)
+        if rss_mb() <= max_rss:
+            return True
+    return rss_mb() <= max_rss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ingest an existing archive of documents into the database")
+    parser.add_argument("root", help="directory tree to ingest, the files stay where they are")
+    parser.add_argument("--db-path", default=os.environ.get("DB_PATH"), help="directory of Documents.db")
+    parser.add_argument("--key-path", default=os.environ.get("KEY_PATH"), help="file with the OpenAI api key")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="extraction processes")
+    parser.add_argument("--documents-per-worker", type=int, default=2,
+                        help="documents every extraction process works on at once, they share the OCR batches")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--llm-base-url", default=os.environ.get("LLM_BASE_URL"))
+    parser.add_argument("--llm-rpm", type=int, default=500)
+    parser.add_argument("--llm-tpm", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=500, help="documents per database transaction")
+    parser.add_argument("--batch-wait", type=float, default=5.0, help="seconds the writer waits to fill a batch")
+    parser.add_argument("--ocr-languages", default="de", help="OCR readers loaded by every worker at start")
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--max-rss", type=float, default=0, help="MB of all processes before the intake pauses")
+    parser.add_argument("--progress-interval", type=float, default=10.0)
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be ingested")
+    parser.add_argument("--retry-failed", action="store_true", help="process the files whose job failed before again")
+    args = parser.parse_args(argv)
+    if not args.db_path:
+        parser.error("--db-path is required")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.dry_run:
+        return dry_run(args.root, args.db_path)
+    if not args.key_path:
+        parser.error("--key-path is required")
+    with open(args.key_path, "r") as file:
+        key = file.read()
+
+    known = known_links(args.db_path)
+    db_manager = DatabaseManager(args.db_path)
+    db_manager.connect()
+    cache = ResultCache(args.db_path)
+    cache.connect()
+    # owned by this process, a rerun takes over the jobs of an interrupted run once its process is gone
+    jobs = JobQueue(args.db_path)
+    jobs.connect()
+    summary_service = SummaryService(key, base_url=args.llm_base_url, max_concurrency=args.llm_concurrency,
+                                     requests_per_minute=args.llm_rpm, tokens_per_minute=args.llm_tpm)
+    summary_service.start()
+    temp_path = tempfile.mkdtemp(prefix="docreader-backfill-")
+    languages = [language for language in args.ocr_languages.split(",") if language]
+
+    pipeline = DocumentPipeline(db_manager, summary_service.summarize_document, None, temp_path,
+                                extract_workers=args.workers, llm_workers=args.llm_concurrency,
+                                documents_per_worker=args.documents_per_worker,
+                                queue_size=2 * args.workers * args.documents_per_worker, dpi=args.dpi, cache=cache,
+                                db_batch_size=args.batch_size, jobs=jobs, move_files=False,
+                                db_max_wait=args.batch_wait,
+                                worker_initializer=warm_up_ocr, worker_initargs=(languages,))
+    progress = Progress(pipeline, args.progress_interval)
+    exit_code = 0
+    pipeline.start()
+    progress.start()
+    try:
+        for path in walk(args.root):
+            progress.walked += 1
+            if path in known:
+                progress.skipped += 1
+                continue
+            if not wait_for_memory(pipeline, args.max_rss):
+                logging.error(f"rss stays above {args.max_rss} MB with nothing in flight, stopping, "
+                              f"a rerun continues where this one stopped")
+                exit_code = EXIT_MAX_RSS
+                break
+            if pipeline.submit(path, retry_failed=args.retry_failed):
+                progress.submitted += 1
+        progress.walk_finished = True
+    except KeyboardInterrupt:
+        logging.info("interrupted, finishing the documents in flight, a rerun continues")
+    finally:
+        pipeline.shutdown()
+        progress.stop()
+        summary_service.close()
+        logging.info(f"LLM usage: {db_manager.token_usage_stats()}")
+        cache.close()
+        jobs.close()
+        db_manager.close()
+        shutil.rmtree(temp_path, ignore_errors=True)
+    failed = sum(count for status, count in pipeline.finished_counts().items() if status != "stored")
+    if failed and not exit_code:
+        logging.warning(f"{failed} documents were not stored, see the log, a rerun with --retry-failed "
+                        f"tries the failed jobs again")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
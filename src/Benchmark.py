@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import fitz
+from Handlers import extract_document
+from chatGPT import SummaryService
+from MockLLMServer import MockLLMServer, DEFAULT_ANSWER
+from Database.DBHandler import DatabaseManager
+from Pipeline import DocumentPipeline
+
+SAMPLE_TEXT = {
+    'de': ["Rechnung Nr. {n} für die Reparatur der Rollläden im Wohnzimmer.",
+           "Bitte überweisen Sie den Betrag von {amount} EUR bis zum {date}.",
+           "Mit freundlichen Grüßen, Ihre Hausverwaltung Erlangen."],
+    'en': ["Invoice number {n} for the repair of the roller shutters.",
+           "Please transfer the amount of {amount} EUR until {date}.",
+           "Kind regards, your property management team."],
+    'zh': ["发票编号 {n}，客厅卷帘维修费用。",
+           "请在 {date} 之前转账 {amount} 欧元。",
+           "此致敬礼，物业管理处。"],
+}
+KINDS = ("text_pdf", "scanned_pdf", "mixed_pdf", "jpeg", "png")
+
+
+def percentile(values, p):
+    """linear interpolated percentile of a list, p in [0, 100]"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_latencies(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+        "total": sum(values),
+    }
+
+
+def peak_rss_mb():
+    """peak resident set size of this process and its finished children, ru_maxrss is KiB on Linux"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self": own / 1024, "children": children / 1024}
+
+
+class CorpusGenerator:
+    """
+    Deterministic synthetic documents: text layer pdfs, scanned-only pdfs,
+    mixed pdfs and jpeg/png photos in every language.
+    """
+
+    def __init__(self, directory, seed=42, pages=3, dpi=150):
+        self.directory = directory
+        self.random = random.Random(seed)
+        self.pages = pages
+        self.dpi = dpi
+
+    def _lines(self, language):
+        values = {"n": self.random.randint(10000, 99999),
+                  "amount": f"{self.random.uniform(10, 5000):.2f}",
+                  "date": f"{self.random.randint(1, 28):02d}-{self.random.randint(1, 12):02d}-2024"}
+        return [line.format(**values) for line in SAMPLE_TEXT[language]]
+
+    def _text_page(self, document, language):
+        page = document.new_page(width=595, height=842)   # A4 in points
+        fontname = "china-s" if language == 'zh' else "helv"
+        for row, line in enumerate(self._lines(language)):
+            page.insert_text((60, 100 + row * 30), line, fontname=fontname, fontsize=14)
+        return page
+
+    def _page_pixmap(self, language):
+        """a text page rendered to an image, like a scanner would deliver it"""
+        with fitz.open() as document:
+            page = self._text_page(document, language)
+            return page.get_pixmap(dpi=self.dpi, colorspace=fitz.csGRAY)
+
+    def _scanned_page(self, document, language):
+        pixmap = self._page_pixmap(language)
+        page = document.new_page(width=595, height=842)
+        page.insert_image(page.rect, stream=pixmap.tobytes("png"))
+
+    def generate(self, docs_per_kind, languages):
+        """
+        :return: list of (path, kind, language)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        corpus = []
+        for language in languages:
+            for kind in KINDS:
+                for number in range(docs_per_kind):
+                    name = f"{kind}_{language}_{number}"
+                    if kind.endswith("pdf"):
+                        path = os.path.join(self.directory, f"{name}.pdf")
+                        with fitz.open() as document:
+                            for page_index in range(self.pages):
+                                scanned = kind == "scanned_pdf" or (kind == "mixed_pdf" and page_index % 2 == 1)
+                                if scanned:
+                                    self._scanned_page(document, language)
+                                else:
+                                    self._text_page(document, language)
+                            document.save(path)
+                    else:
+                        path = os.path.join(self.directory, f"{name}.{'jpg' if kind == 'jpeg' else 'png'}")
+                        self._page_pixmap(language).save(path)
+                    corpus.append((path, kind, language))
+        return corpus
+
+
+def bench_stages(corpus, temp_path, summary_service, db_manager):
+    """run every document through the stages one by one and time each stage"""
+    stages = {"extract": [], "llm": [], "db_insert": []}
+    per_kind = {}
+    pages = 0
+    for path, kind, language in corpus:
+        start = time.perf_counter()
+        text = extract_document(path, temp_path)
+        extract_seconds = time.perf_counter() - start
+        stages["extract"].append(extract_seconds)
+        per_kind.setdefault(kind, []).append(extract_seconds)
+
+        start = time.perf_counter()
+        summary, usage = summary_service.summarize_document(text or " ")
+        stages["llm"].append(time.perf_counter() - start)
+        pages += usage["pages"]
+
+        start = time.perf_counter()
+        db_manager.insert_new_element(summary, link=path, extracted_text=text, usage=usage)
+        stages["db_insert"].append(time.perf_counter() - start)
+
+    return {
+        "stages": {stage: summarize_latencies(values) for stage, values in stages.items()},
+        "extract_by_kind": {kind: summarize_latencies(values) for kind, values in per_kind.items()},
+        "pages": pages,
+    }
+
+
+def bench_pipeline(corpus, work_directory, temp_path, summary_service, db_manager, workers):
+    """end to end throughput of the staged pipeline"""
+    handled = os.path.join(work_directory, "handled")
+    inbox = os.path.join(work_directory, "inbox")
+    os.makedirs(inbox, exist_ok=True)
+    files = []
+    for path, _, _ in corpus:
+        target = os.path.join(inbox, os.path.basename(path))
+        shutil.copy(path, target)
+        files.append(target)
+
+    pipeline = DocumentPipeline(db_manager, summary_service.summarize_document, handled, temp_path,
+                                extract_workers=workers, llm_workers=summary_service.max_concurrency)
+    start = time.perf_counter()
+    pipeline.start()
+    for path in files:
+        pipeline.submit(path)
+    pipeline.shutdown()
+    elapsed = time.perf_counter() - start
+    return {"documents": len(files), "seconds": elapsed,
+            "docs_per_minute": len(files) / elapsed * 60 if elapsed else None}
+
+
+def bench_db_writes(db_directory, documents, batch_size):
+    """write throughput of single inserts and of batched transactions"""
+    db_manager = DatabaseManager(db_directory)
+    db_manager.connect()
+    json_str = json.dumps(DEFAULT_ANSWER)
+
+    start = time.perf_counter()
+    for number in range(documents):
+        db_manager.insert_new_element(json_str, link=f"single/{number}")
+    single_seconds = time.perf_counter() - start
+
+    rows = 0
+    start = time.perf_counter()
+    for offset in range(0, documents, batch_size):
+        count = min(batch_size, documents - offset)
+        db_manager.insert_batch([(json_str, f"batch/{offset + i}") for i in range(count)])
+        rows += db_manager.last_write_stats["rows"]
+    batch_seconds = time.perf_counter() - start
+    db_manager.close()
+
+    return {
+        "documents": documents,
+        "single_docs_per_sec": documents / single_seconds if single_seconds else None,
+        "batch_size": batch_size,
+        "batch_docs_per_sec": documents / batch_seconds if batch_seconds else None,
+        "batch_rows_per_sec": rows / batch_seconds if batch_seconds else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="reproducible benchmark of the ingestion pipeline")
+    parser.add_argument("--output", default="benchmark.json", help="json file the results are written to")
+    parser.add_argument("--docs-per-kind", type=int, default=2)
+    parser.add_argument("--languages", default="de,en,zh")
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds the stub LLM waits per request")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--db-docs", type=int, default=2000)
+    parser.add_argument("--db-batch-size", type=int, default=500)
+    parser.add_argument("--skip-pipeline", action="store_true")
+    args = parser.parse_args(argv)
+
+    work_directory = tempfile.mkdtemp(prefix="docreader-bench-")
+    temp_path = os.path.join(work_directory, "tmp")
+    os.makedirs(temp_path)
+    mock = MockLLMServer(latency=args.llm_latency).start()
+    summary_service = SummaryService("benchmark", base_url=mock.base_url, max_concurrency=args.llm_concurrency,
+                                     requests_per_minute=100000, tokens_per_minute=100000000)
+    summary_service.start()
+
+    try:
+        start = time.perf_counter()
+        corpus = CorpusGenerator(os.path.join(work_directory, "corpus"), seed=args.seed,
+                                 pages=args.pages).generate(args.docs_per_kind, args.languages.split(","))
+        generate_seconds = time.perf_counter() - start
+
+        stage_db = os.path.join(work_directory, "stage_db")
+        os.makedirs(stage_db)
+        db_manager = DatabaseManager(stage_db)
+        db_manager.connect()
+        results = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "args": vars(args),
+                "corpus_documents": len(corpus),
+                "corpus_seconds": generate_seconds,
+            },
+            "stage_latency": bench_stages(corpus, temp_path, summary_service, db_manager),
+        }
+
+        if not args.skip_pipeline:
+            pipeline_db = os.path.join(work_directory, "pipeline_db")
+            os.makedirs(pipeline_db)
+            pipeline_manager = DatabaseManager(pipeline_db)
+            pipeline_manager.connect()
+            results["pipeline"] = bench_pipeline(corpus, work_directory, temp_path, summary_service,
+                                                 pipeline_manager, args.workers)
+            pipeline_manager.close()
+
+        db_manager.close()
+        write_db = os.path.join(work_directory, "write_db")
+        os.makedirs(write_db)
+        results["sqlite_writes"] = bench_db_writes(write_db, args.db_docs, args.db_batch_size)
+        results["llm"] = {"requests": summary_service.requests, "retries": summary_service.retries,
+                          "corrections": summary_service.corrections,
+                          "stub_requests": mock.requests}
+        results["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        summary_service.close()
+        mock.stop()
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"benchmark results written to {args.output}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
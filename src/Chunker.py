@@ -0,0 +1,74 @@
+import re
+import tiktoken
+from Handlers import PAGE_SEPARATOR
+
+
+def get_encoding(model):
+    """tokenizer of the model, fine-tuned or unknown models fall back to the newest known encoding"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    for name in ("o200k_base", "cl100k_base"):
+        try:
+            return tiktoken.get_encoding(name)
+        except ValueError:
+            continue
+    raise RuntimeError("no tiktoken encoding available")
+
+
+class TextChunker:
+    """
+    Splits extracted text into chunks of at most max_chunk_tokens tokens.
+    Cuts are made at page boundaries first, then at paragraphs and lines,
+    only text without any of those is cut in the middle.
+    """
+
+    def __init__(self, model="gpt-4o-mini", max_chunk_tokens=4000):
+        self.encoding = get_encoding(model)
+        self.max_chunk_tokens = max_chunk_tokens
+
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def split(self, text):
+        """
+        :return: list of chunks, a text that fits is returned as the only chunk
+        """
+        if self.count(text) <= self.max_chunk_tokens:
+            return [text]
+
+        units = []
+        for page in text.split(PAGE_SEPARATOR):
+            units.extend(self._split_unit(page, (r"\n\s*\n", r"\n")))
+        return self._pack(units)
+
+    def _split_unit(self, text, separators):
+        """break a piece of text into parts that fit, using the coarsest separator possible"""
+        if self.count(text) <= self.max_chunk_tokens:
+            return [text] if text.strip() else []
+        if not separators:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return [self.encoding.decode(tokens[i:i + self.max_chunk_tokens])
+                    for i in range(0, len(tokens), self.max_chunk_tokens)]
+        parts = []
+        for part in re.split(separators[0], text):
+            parts.extend(self._split_unit(part, separators[1:]))
+        return parts
+
+    def _pack(self, units):
+        """greedily join consecutive units as long as the chunk stays in budget"""
+        chunks = []
+        current = []
+        current_tokens = 0
+        for unit in units:
+            unit_tokens = self.count(unit) + 1   # separator
+            if current and current_tokens + unit_tokens > self.max_chunk_tokens:
+                chunks.append("\n".join(current))
+                current = []
+                current_tokens = 0
+            current.append(unit)
+            current_tokens += unit_tokens
+        if current:
+            chunks.append("\n".join(current))
+        return chunks
@@ -0,0 +1,146 @@
+import sqlite3
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+
+EVICT_INTERVAL = 100   # run the eviction after this many stores
+
+class ResultCache:
+
+    def __init__(self, db_path, max_size_mb=512, max_age_days=90):
+        """
+        Cache of extracted text and model json keyed by content hash, stored
+        in the result_cache table next to the documents.
+        :param db_path: Path to the directory of the database file
+        :param max_size_mb: upper bound for the cached text and json
+        :param max_age_days: entries older than this are evicted
+        """
+        self.db_path = os.path.join(db_path, "Documents.db")
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.connection = None
+        self.lock = threading.Lock()
+        self.file_hits = 0
+        self.text_hits = 0
+        self.misses = 0
+        self._stores = 0
+
+    def connect(self):
+        """
+        Open an own connection, the cache is used from the extraction and LLM threads.
+        The table itself is created by DatabaseManager.connect.
+        """
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+
+    @staticmethod
+    def file_hash(file_path):
+        """SHA-256 of the file bytes"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def text_hash(text):
+        """SHA-256 of the normalized text, so a rescan with other whitespace or case still matches"""
+        normalized = re.sub(r"\s+", " ", text).strip().lower()
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def lookup_file(self, file_hash):
+        """
+        :return: (extracted_text, json_str) of an identical file or None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT extracted_text, json_str FROM result_cache WHERE file_hash = ? AND json_str IS NOT NULL;",
+                (file_hash,)).fetchone()
+            if row is None:
+                return None
+            self.file_hits += 1
+            self._touch("file_hash", file_hash)
+            return row
+
+    def lookup_text(self, text_hash):
+        """
+        :return: json_str of a document with the same normalized text or None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT json_str FROM result_cache WHERE text_hash = ? AND json_str IS NOT NULL LIMIT 1;",
+                (text_hash,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.text_hits += 1
+            self._touch("text_hash", text_hash)
+            return row[0]
+
+    def _touch(self, column, value):
+        self.connection.execute(f"UPDATE result_cache SET last_hit = ? WHERE {column} = ?;", (time.time(), value))
+        self.connection.commit()
+
+    def store(self, file_hash, text_hash, extracted_text, json_str):
+        """
+        Insert or replace the results of a file.
+        """
+        now = time.time()
+        size_bytes = len(extracted_text.encode('utf-8')) + len(json_str.encode('utf-8'))
+        with self.lock:
+            self.connection.execute(
+                """
+                INSERT OR REPLACE INTO result_cache (file_hash, text_hash, extracted_text, json_str, size_bytes, created_at, last_hit)
+                VALUES (?, ?, ?, ?, ?, ?, ?);
+                """,
+                (file_hash, text_hash, extracted_text, json_str, size_bytes, now, now))
+            self.connection.commit()
+            self._stores += 1
+            run_eviction = self._stores % EVICT_INTERVAL == 0
+
+        if run_eviction:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop entries older than max_age_days, then the least recently hit ones
+        until the cache fits into max_size_mb.
+        :return: number of removed entries
+        """
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM result_cache WHERE created_at < ?;",
+                                             (time.time() - self.max_age_seconds,))
+            removed = cursor.rowcount
+
+            total = self.connection.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM result_cache;").fetchone()[0]
+            if total > self.max_size_bytes:
+                rows = self.connection.execute("SELECT file_hash, size_bytes FROM result_cache ORDER BY last_hit;").fetchall()
+                to_delete = []
+                for file_hash, size_bytes in rows:
+                    if total <= self.max_size_bytes:
+                        break
+                    to_delete.append((file_hash,))
+                    total -= size_bytes
+                self.connection.executemany("DELETE FROM result_cache WHERE file_hash = ?;", to_delete)
+                removed += len(to_delete)
+            self.connection.commit()
+
+        if removed:
+            logging.info(f"evicted {removed} entries from result cache")
+        return removed
+
+    def stats(self):
+        """hit/miss counters of this process"""
+        lookups = self.file_hits + self.text_hits + self.misses
+        return {
+            "file_hits": self.file_hits,
+            "text_hits": self.text_hits,
+            "misses": self.misses,
+            "hit_rate": (self.file_hits + self.text_hits) / lookups if lookups else 0.0,
+        }
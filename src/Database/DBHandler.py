@@ -1,32 +1,120 @@
 import sqlite3
 import os
+import re
 import json
+import math
+import time
+import logging
+from contextlib import contextmanager
+
+# tables written by insert_new_element, in foreign key order
+DOCUMENT_TABLES = ("documents", "bank_info", "amount", "related_info", "address", "recipients")
+
+# columns returned by the query methods
+DOCUMENT_COLUMNS = ("id", "title", "summary", "reference_number", "language", "timestamp", "link_original")
+
+
+def amount_cents(value):
+    """
+    Amount as the model wrote it, 150.08, "1.234,56 €", "ca. 150" or "150,-", in
+    exact cents, with the rules of Export.parse_amounts: the last separator
+    followed by one or two digits is the decimal point, a dot followed by groups
+    of three digits only is the German thousands separator.
+    :return: int, None where nothing could be read
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return round(value * 100) if math.isfinite(value) else None
+    text = str(value).strip()
+    text = re.sub(r"^[^\W\d_]+\.?\s*", "", text)   # "ca. 150", "EUR 150"
+    text = re.sub(r"[,.]-+$", "", text)        # "150,-"
+    text = re.sub(r"[^\d,.\-]", "", text)      # currency, spaces and apostrophes
+    if re.match(r"-?[,.]", text):
+        return None
+    if text.rfind(",") > text.rfind(".") and not re.fullmatch(r"-?\d{1,3}(,\d{3})+", text):
+        text = text.replace(".", "").replace(",", ".")
+    elif "," not in text and re.fullmatch(r"-?\d{1,3}(\.\d{3})+", text):
+        text = text.replace(".", "")
+    else:
+        text = text.replace(",", "")
+    try:
+        return round(float(text) * 100)
+    except ValueError:
+        return None
+
 
 class DatabaseManager:
     
-    def __init__(self, db_path):
+    def __init__(self, db_path, synchronous="NORMAL", cache_size_kb=65536):
         """
         Initialize the DatabaseManager class, setting up the database connection 
         and executing the table structure script.
         :param db_path: Path to the database file
         :param schema_path: Path to the SQL file containing the table structure
+        :param synchronous: value of PRAGMA synchronous, NORMAL is safe in WAL mode
+        :param cache_size_kb: page cache of the connection in KiB
         """
         self.db_path = os.path.join(db_path, "Documents.db")
         current_dir = os.path.dirname(__file__)
         self.schema_path = os.path.join(current_dir,"sceleton.sql")
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
         self.connection = None
         self.cursor = None
+        self._in_transaction = False
+        self.last_write_stats = None
         
     def connect(self):
         """
         Connect to the database and read the table structure from the SQL file.
         """
         
-        self.connection = sqlite3.connect(self.db_path)
+        # the connection is handed to the pipeline's single writer thread
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
         self.cursor = self.connection.cursor()
+        # WAL lets readers work during writes and needs far fewer fsyncs
+        self.cursor.execute("PRAGMA journal_mode=WAL;")
+        self.cursor.execute(f"PRAGMA synchronous={self.synchronous};")
+        self.cursor.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)};")
+        rebuild_fts = self._migrate()
         with open(self.schema_path, 'r') as file:
             schema_sql = file.read()
         self.cursor.executescript(schema_sql)
+        if rebuild_fts:
+            # index the rows which were stored before the full text table existed
+            self.cursor.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild');")
+            self.connection.commit()
+
+    def _migrate(self):
+        """
+        Bring a database created by an older sceleton.sql up to date.
+        :return: True if the full text index has to be built from existing rows
+        """
+        tables = {row[0] for row in self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+        if "amount" in tables:
+            columns = {row[1] for row in self.cursor.execute("PRAGMA table_info(amount);")}
+            if "value_cents" not in columns:
+                # CAST(value AS REAL) read "1.234,56" as 1.234, the amounts are parsed once instead
+                self.cursor.execute("DROP INDEX IF EXISTS idx_amount_value;")
+                self.cursor.execute("ALTER TABLE amount ADD COLUMN value_cents INTEGER;")
+                rows = self.cursor.execute("SELECT id, value FROM amount;").fetchall()
+                self.cursor.executemany("UPDATE amount SET value_cents = ? WHERE id = ?;",
+                                        [(amount_cents(value), amount_id) for amount_id, value in rows])
+                self.connection.commit()
+        if "jobs" in tables:
+            columns = {row[1] for row in self.cursor.execute("PRAGMA table_info(jobs);")}
+            for column, kind in (("file_mtime", "REAL"), ("file_size", "INT")):
+                if column not in columns:
+                    self.cursor.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind};")
+            self.connection.commit()
+        if "documents" not in tables:
+            return False
+        columns = {row[1] for row in self.cursor.execute("PRAGMA table_info(documents);")}
+        if "extracted_text" not in columns:
+            self.cursor.execute("ALTER TABLE documents ADD COLUMN extracted_text TEXT;")
+            self.connection.commit()
+        return "documents_fts" not in tables
         
     def close(self):
         """
@@ -36,8 +124,37 @@ class DatabaseManager:
             self.cursor.close()
         if self.connection:
             self.connection.close()
+
+    def _commit(self):
+        """
+        Commit, unless the statement is part of an open transaction().
+        """
+        if not self._in_transaction:
+            self.connection.commit()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group several inserts into one transaction with a single commit.
+        Rolls back everything if an exception is raised inside the block.
+        """
+        if self._in_transaction:
+            yield
+            return
+        self.connection.commit()   # close any implicit transaction
+        self.cursor.execute("BEGIN IMMEDIATE;")
+        self._in_transaction = True
+        try:
+            yield
+        except BaseException:
+            self.connection.rollback()
+            raise
+        else:
+            self.connection.commit()
+        finally:
+            self._in_transaction = False
             
-    def insert_document(self, title, summary, reference_number, language, timestamp, link_original, json_str):
+    def insert_document(self, title, summary, reference_number, language, timestamp, link_original, json_str, extracted_text=None):
         """
         Insert data into the documents table.
         :param title: Document title
@@ -47,15 +164,16 @@ class DatabaseManager:
         :param timestamp: Timestamp
         :param link_original: the link to the scanned doc
         :param json_str: the return str from ai assistant
+        :param extracted_text: the text the summary was made from
         :return: The document_id of the inserted record
         """
         document_sql = """
-        INSERT INTO documents (title, summary, reference_number, language, timestamp, link_original, json_str)
-        VALUES (?, ?, ?, ?, ?, ?, ?);
+        INSERT INTO documents (title, summary, reference_number, language, timestamp, link_original, json_str, extracted_text)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
         """
-        document_values = (title, summary, reference_number, language, timestamp, link_original, json_str)
+        document_values = (title, summary, reference_number, language, timestamp, link_original, json_str, extracted_text)
         self.cursor.execute(document_sql, document_values)
-        self.connection.commit()
+        self._commit()
         return self.cursor.lastrowid
     
     def insert_bank_info(self, bank_name, account_number, account_holder, transfer_deadline, document_id):
@@ -73,7 +191,7 @@ class DatabaseManager:
         """
         bank_info_values = (bank_name, account_number, account_holder, transfer_deadline, document_id)
         self.cursor.execute(bank_info_sql, bank_info_values)
-        self.connection.commit()
+        self._commit()
         return self.cursor.lastrowid
     
     def insert_amount(self, currency, value, bank_info_id):
@@ -84,12 +202,12 @@ class DatabaseManager:
         :param bank_info_id: Associated bank_info_id
         """
         amount_sql = """
-        INSERT INTO amount (currency, value, bank_info_id)
-        VALUES (?, ?, ?);
+        INSERT INTO amount (currency, value, value_cents, bank_info_id)
+        VALUES (?, ?, ?, ?);
         """
-        amount_values = (currency, value, bank_info_id)
+        amount_values = (currency, value, amount_cents(value), bank_info_id)
         self.cursor.execute(amount_sql, amount_values)
-        self.connection.commit()
+        self._commit()
         
     def insert_related_info(self, name, company, position, phone, email, document_id):
         """
@@ -108,7 +226,7 @@ class DatabaseManager:
         """
         related_info_values = (name, company, position, phone, email, document_id)
         self.cursor.execute(related_info_sql, related_info_values)
-        self.connection.commit()
+        self._commit()
         return self.cursor.lastrowid
     
     def insert_address(self, street, city, postal_code, country, related_info_id):
@@ -126,7 +244,7 @@ class DatabaseManager:
         """
         address_values = (street, city, postal_code, country, related_info_id)
         self.cursor.execute(address_sql, address_values)
-        self.connection.commit()
+        self._commit()
         
     def insert_recipient(self, name, email, document_id):
         """
@@ -141,105 +259,315 @@ class DatabaseManager:
         """
         recipients_values = (name, email, document_id)
         self.cursor.execute(recipients_sql, recipients_values)
-        self.connection.commit()
-        
-    def insert_new_element(self, json_str, link):
-        data = json.loads(json_str)
+        self._commit()
         
-        title = data.get('title', 'N/A')  # Default to 'N/A' if not found
-        summary = data.get('summary', 'N/A')
-        reference_number = data.get('reference_number', 'N/A')
-        language = data.get('language', 'N/A')
-        timestamp = data.get('timestamp', 'N/A')
+    def insert_new_element(self, summary, link, extracted_text=None, usage=None, json_str=None):
+        """
+        Insert the whole document graph of one model answer in one transaction.
+        :param summary: the return str from ai assistant, or the validated DocumentSummary or its dict
+        :param link: the link to the scanned doc
+        :param extracted_text: the text the summary was made from
+        :param usage: token usage dict of the summary, see SummaryService.summarize_document
+        :param json_str: serialized summary stored with the document, made from summary if not given
+        :return: The document_id of the inserted record
+        """
+        graph = self.build_document_graph(summary, link, extracted_text, usage, json_str)
+        return self.write_document_graphs([graph])[0]
+
+    def insert_batch(self, elements):
+        """
+        Insert many documents in one transaction.
+        Elements whose json can not be parsed are logged and skipped.
+        :param elements: iterable of (summary, link[, extracted_text[, usage[, json_str]]]), see insert_new_element
+        :return: list of document_ids in input order, None for skipped elements
+        """
+        graphs = []
+        for element in elements:
+            link = element[1]
+            try:
+                graphs.append(self.build_document_graph(*element))
+            except (ValueError, TypeError, AttributeError) as e:
+                logging.error("insert_batch skipped %s: %s", link, e)
+                graphs.append(None)
+
+        document_ids = self.write_document_graphs([graph for graph in graphs if graph is not None])
+        written = iter(document_ids)
+        return [None if graph is None else next(written) for graph in graphs]
+
+    @staticmethod
+    def build_document_graph(summary, link, extracted_text=None, usage=None, json_str=None):
+        """
+        Turn a model answer into the rows of all document tables.
+        A validated DocumentSummary or dict is used as it is, only a string is parsed.
+        :return: dict with the document row and its related rows, without ids
+        """
+        if isinstance(summary, str):
+            json_str = json_str or summary
+            data = json.loads(summary)
+        else:
+            data = summary if isinstance(summary, dict) else summary.model_dump()
+            if json_str is None:
+                json_str = json.dumps(data, ensure_ascii=False)
         
-        document_id = self.insert_document(title=title, summary=summary, reference_number=reference_number, language=language, timestamp=timestamp, link_original=link, json_str=json_str)
+        graph = {
+            "document": (data.get('title', 'N/A'),  # Default to 'N/A' if not found
+                         data.get('summary', 'N/A'),
+                         data.get('reference_number', 'N/A'),
+                         data.get('language', 'N/A'),
+                         data.get('timestamp', 'N/A'),
+                         link,
+                         json_str,
+                         extracted_text),
+            "related": [],
+            "recipients": [],
+            "usage": None,
+        }
+        if usage:
+            graph["usage"] = (usage.get("chunks"), usage.get("pages"), usage.get("prompt_tokens"),
+                              usage.get("completion_tokens"), usage.get("latency_seconds"))
         
         # Accessing bank_info sub-layer data
         bank_info = data.get('bank_info', {})
-        bank_name = bank_info.get('bank_name', 'N/A')
-        account_number = bank_info.get('account_number', 'N/A')
-        account_holder = bank_info.get('account_holder', 'N/A')
-        transfer_deadline = bank_info.get('transfer_deadline', 'N/A')
-        
-        bank_info_id = self.insert_bank_info(bank_name=bank_name, account_number=account_number, account_holder=account_holder, transfer_deadline=transfer_deadline, document_id=document_id)
+        graph["bank_info"] = (bank_info.get('bank_name', 'N/A'),
+                              bank_info.get('account_number', 'N/A'),
+                              bank_info.get('account_holder', 'N/A'),
+                              bank_info.get('transfer_deadline', 'N/A'))
         
         # Accessing amount sub-layer data within bank_info
         amount_info = bank_info.get('amount', {})
-        currency = amount_info.get('currency', 'N/A')
         value = amount_info.get('value', 'N/A')
-        
-        self.insert_amount(currency=currency, value=value, bank_info_id=bank_info_id)
+        graph["amount"] = (amount_info.get('currency', 'N/A'), value, amount_cents(value))
         
         related_info = data.get('related_companies_or_people', [])
         
         # Check if related_people_list is empty
         if not related_info:
-            related_info_id = self.insert_related_info(name="N/A", company="N/A", position="N/A", phone="N/A", email="N/A", document_id=document_id)
-            self.insert_address(street="N/A", city="N/A", postal_code="N/A", country="N/A", related_info_id=related_info_id)
+            graph["related"].append((("N/A", "N/A", "N/A", "N/A", "N/A"), ("N/A", "N/A", "N/A", "N/A")))
         else:
             if isinstance(related_info, dict):
-                name = related_info.get('name', 'N/A')
-                company = related_info.get('company', 'N/A')
-                position = related_info.get('position', 'N/A')
-                contact_info = related_info.get('contact_info', {})
-
+                related_info = [related_info]
+            elif not isinstance(related_info, list):
+                raise TypeError("not allowed format")
+            for info in related_info:
+                contact_info = info.get('contact_info', {})
                 # Extracting contact details
-                phone = contact_info.get('phone', 'N/A')
-                email = contact_info.get('email', 'N/A')
-                
-                related_info_id = self.insert_related_info(name=name, company=company, position=position, phone=phone, email=email, document_id=document_id)
+                person = (info.get('name', 'N/A'),
+                          info.get('company', 'N/A'),
+                          info.get('position', 'N/A'),
+                          contact_info.get('phone', 'N/A'),
+                          contact_info.get('email', 'N/A'))
                 
                 address = contact_info.get('address', {})
                 # Extracting address details
-                street = address.get('street', 'N/A')
-                city = address.get('city', 'N/A')
-                postal_code = address.get('postal_code', 'N/A')
-                country = address.get('country', 'N/A')
-                
-                self.insert_address(street=street, city=city, postal_code=postal_code, country=country, related_info_id=related_info_id)
-                
-            elif isinstance(related_info, list):
-                for info in related_info:
-                    name = info.get('name', 'N/A')
-                    company = info.get('company', 'N/A')
-                    position = info.get('position', 'N/A')
-                    contact_info = info.get('contact_info', {})
-
-                    # Extracting contact details
-                    phone = contact_info.get('phone', 'N/A')
-                    email = contact_info.get('email', 'N/A')
-                    
-                    related_info_id = self.insert_related_info(name=name, company=company, position=position, phone=phone, email=email, document_id=document_id)
-                    
-                    address = contact_info.get('address', {})
-                    # Extracting address details
-                    street = address.get('street', 'N/A')
-                    city = address.get('city', 'N/A')
-                    postal_code = address.get('postal_code', 'N/A')
-                    country = address.get('country', 'N/A')
-                    
-                    self.insert_address(street=street, city=city, postal_code=postal_code, country=country, related_info_id=related_info_id)
-            else:
-                raise TypeError("not allowed format")
+                place = (address.get('street', 'N/A'),
+                         address.get('city', 'N/A'),
+                         address.get('postal_code', 'N/A'),
+                         address.get('country', 'N/A'))
+                graph["related"].append((person, place))
                 
         recipients = data.get('recipients', {})
         if not recipients:
-            self.insert_recipient(name="N/A", email="N/A", document_id=document_id)
+            graph["recipients"].append(("N/A", "N/A"))
         else:
             if isinstance(recipients, dict):
-                name_recipients = recipients.get('name', 'N/A')
-                email_recipients = recipients.get('email', 'N/A')
-                self.insert_recipient(name=name_recipients, email=email_recipients, document_id=document_id)
-            elif isinstance(recipients, list):
-                for person in recipients:
-                    name_recipients = person.get('name', 'N/A')
-                    email_recipients = person.get('email', 'N/A')
-                    self.insert_recipient(name=name_recipients, email=email_recipients, document_id=document_id)
-            else:
+                recipients = [recipients]
+            elif not isinstance(recipients, list):
                 raise TypeError("not allowed format")
-        
-        
+            for person in recipients:
+                graph["recipients"].append((person.get('name', 'N/A'), person.get('email', 'N/A')))
+
+        return graph
+
+    def write_document_graphs(self, graphs):
+        """
+        Write document graphs with one executemany per table inside one transaction.
+        The ids are assigned here, which is safe because BEGIN IMMEDIATE holds the write lock.
+        :param graphs: list of dicts from build_document_graph
+        :return: list of the new document_ids
+        """
+        if not graphs:
+            return []
+        start = time.perf_counter()
+        rows = {table: [] for table in DOCUMENT_TABLES + ("llm_usage",)}
+        document_ids = []
+
+        with self.transaction():
+            next_id = {}
+            for table in DOCUMENT_TABLES:
+                self.cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table};")
+                next_id[table] = self.cursor.fetchone()[0] + 1
+
+            def allocate(table):
+                new_id = next_id[table]
+                next_id[table] += 1
+                return new_id
+
+            for graph in graphs:
+                document_id = allocate("documents")
+                document_ids.append(document_id)
+                rows["documents"].append((document_id,) + graph["document"])
+
+                bank_info_id = allocate("bank_info")
+                rows["bank_info"].append((bank_info_id,) + graph["bank_info"] + (document_id,))
+                rows["amount"].append((allocate("amount"),) + graph["amount"] + (bank_info_id,))
+
+                for person, place in graph["related"]:
+                    related_info_id = allocate("related_info")
+                    rows["related_info"].append((related_info_id,) + person + (document_id,))
+                    rows["address"].append((allocate("address"),) + place + (related_info_id,))
+
+                for recipient in graph["recipients"]:
+                    rows["recipients"].append((allocate("recipients"),) + recipient + (document_id,))
+
+                if graph["usage"]:
+                    rows["llm_usage"].append(graph["usage"] + (document_id,))
+
+            self.cursor.executemany("""
+            INSERT INTO documents (id, title, summary, reference_number, language, timestamp, link_original, json_str, extracted_text)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """, rows["documents"])
+            self.cursor.executemany("""
+            INSERT INTO bank_info (id, bank_name, account_number, account_holder, transfer_deadline, document_id)
+            VALUES (?, ?, ?, ?, ?, ?);
+            """, rows["bank_info"])
+            self.cursor.executemany("""
+            INSERT INTO amount (id, currency, value, value_cents, bank_info_id)
+            VALUES (?, ?, ?, ?, ?);
+            """, rows["amount"])
+            self.cursor.executemany("""
+            INSERT INTO related_info (id, name, company, position, phone, email, document_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?);
+            """, rows["related_info"])
+            self.cursor.executemany("""
+            INSERT INTO address (id, street, city, postal_code, country, related_info_id)
+            VALUES (?, ?, ?, ?, ?, ?);
+            """, rows["address"])
+            self.cursor.executemany("""
+            INSERT INTO recipients (id, name, email, document_id)
+            VALUES (?, ?, ?, ?);
+            """, rows["recipients"])
+            self.cursor.executemany("""
+            INSERT INTO llm_usage (chunks, pages, prompt_tokens, completion_tokens, latency_seconds, document_id)
+            VALUES (?, ?, ?, ?, ?, ?);
+            """, rows["llm_usage"])
+
+        elapsed = time.perf_counter() - start
+        row_count = sum(len(table_rows) for table_rows in rows.values())
+        self.last_write_stats = {
+            "documents": len(graphs),
+            "rows": row_count,
+            "seconds": elapsed,
+            "rows_per_sec": row_count / elapsed if elapsed > 0 else float("inf"),
+        }
+        logging.info(f"wrote {len(graphs)} documents ({row_count} rows) in {elapsed:.3f}s, "
+                     f"{self.last_write_stats['rows_per_sec']:.0f} rows/sec")
+        return document_ids
+
+    def _page(self, where_sql, params, page, page_size, order_sql="d.id DESC"):
+        """
+        Run a documents query and return one page of it.
+        One row more than asked for is fetched to know if another page exists.
+        """
+        page = max(1, int(page))
+        page_size = max(1, int(page_size))
+        columns = ", ".join(f"d.{column}" for column in DOCUMENT_COLUMNS)
+        sql = f"""
+        SELECT {columns} FROM documents d
+        {where_sql}
+        ORDER BY {order_sql}
+        LIMIT ? OFFSET ?;
+        """
+        rows = self.connection.execute(sql, tuple(params) + (page_size + 1, (page - 1) * page_size)).fetchall()
+        return {
+            "items": [dict(zip(DOCUMENT_COLUMNS, row)) for row in rows[:page_size]],
+            "page": page,
+            "page_size": page_size,
+            "has_more": len(rows) > page_size,
+        }
+
+    def search_documents(self, term, page=1, page_size=20):
+        """
+        Full text search over title, summary and extracted text, best matches first.
+        Every word of the term has to occur, FTS operators in the term are taken literally.
+        :param term: words to search for
+        """
+        words = term.split()
+        if not words:
+            return self._page("WHERE 0", (), page, page_size)
+        match = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+        return self._page("JOIN documents_fts f ON f.rowid = d.id WHERE documents_fts MATCH ?",
+                          (match,), page, page_size, order_sql="f.rank")
+
+    def find_by_amount(self, min_value=None, max_value=None, currency=None, page=1, page_size=20):
+        """
+        Documents whose amount lies in [min_value, max_value].
+        :param currency: optional currency code the amount has to be in
+        """
+        conditions = ["a.value_cents IS NOT NULL"]
+        params = []
+        if min_value is not None:
+            conditions.append("a.value_cents >= ?")
+            params.append(round(min_value * 100))
+        if max_value is not None:
+            conditions.append("a.value_cents <= ?")
+            params.append(round(max_value * 100))
+        if currency is not None:
+            conditions.append("a.currency = ?")
+            params.append(currency)
+        where_sql = f"""
+        WHERE d.id IN (
+            SELECT b.document_id FROM amount a JOIN bank_info b ON b.id = a.bank_info_id
+            WHERE {" AND ".join(conditions)})
+        """
+        return self._page(where_sql, params, page, page_size)
+
+    def find_by_iban(self, iban, page=1, page_size=20):
+        """
+        Documents with a bank account, spaces and case of the IBAN are ignored.
+        """
+        normalized = iban.replace(" ", "").upper()
+        where_sql = """
+        WHERE d.id IN (
+            SELECT document_id FROM bank_info WHERE REPLACE(UPPER(account_number), ' ', '') = ?)
+        """
+        return self._page(where_sql, (normalized,), page, page_size)
+
+    def find_by_sender(self, sender, page=1, page_size=20):
+        """
+        Documents from a person or company, matched case-insensitively against
+        related people, their companies and the account holder.
+        """
+        where_sql = """
+        WHERE d.id IN (
+            SELECT document_id FROM related_info WHERE name = ? COLLATE NOCASE
+            UNION SELECT document_id FROM related_info WHERE company = ? COLLATE NOCASE
+            UNION SELECT document_id FROM bank_info WHERE account_holder = ? COLLATE NOCASE)
+        """
+        return self._page(where_sql, (sender, sender, sender), page, page_size)
+
+    def find_by_reference(self, reference_number, page=1, page_size=20):
+        """
+        Documents with the reference number.
+        """
+        return self._page("WHERE d.reference_number = ?", (reference_number,), page, page_size)
+
+    def token_usage_stats(self):
+        """
+        Totals of the recorded LLM usage and the cost and latency per page.
+        """
+        row = self.connection.execute("""
+        SELECT COUNT(*), COALESCE(SUM(pages), 0), COALESCE(SUM(chunks), 0),
+               COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(latency_seconds), 0)
+        FROM llm_usage;
+        """).fetchone()
+        documents, pages, chunks, prompt_tokens, completion_tokens, latency = row
+        return {
+            "documents": documents,
+            "pages": pages,
+            "chunks": chunks,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_per_page": (prompt_tokens + completion_tokens) / pages if pages else 0.0,
+            "latency_per_page": latency / pages if pages else 0.0,
+        }
 
-                
-                
-        
\ No newline at end of file
@@ -0,0 +1,287 @@
+import os
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+import importlib.util
+
+MISSING_VALUES = ("N/A", "")   # placeholder of the model for unknown values and empty answers
+
+# one row per amount with its bank info, document and counterparties, the
+# amount id only grows, so it is the watermark of the incremental export
+PAYMENTS_SELECT = """
+SELECT a.id AS amount_id, d.id AS document_id, d.title, d.reference_number, d.language,
+       d.timestamp AS document_date, b.transfer_deadline, a.value AS amount, a.currency,
+       b.bank_name, b.account_number, b.account_holder,
+       (SELECT json_group_array(DISTINCT CASE WHEN r.company <> 'N/A' THEN r.company ELSE r.name END)
+        FROM related_info r WHERE r.document_id = d.id AND (r.company <> 'N/A' OR r.name <> 'N/A'))
+        AS counterparties
+FROM amount a
+JOIN bank_info b ON b.id = a.bank_info_id
+JOIN documents d ON d.id = b.document_id
+WHERE a.id > ?
+ORDER BY a.id
+LIMIT ?;
+"""
+
+# columns of export_payments in sceleton.sql
+PAYMENT_COLUMNS = ("amount_id", "document_id", "title", "reference_number", "language", "document_date",
+                   "transfer_deadline", "amount", "amount_cents", "currency", "bank_name", "account_number",
+                   "account_holder", "counterparties")
+
+# symbols and names the model writes instead of the ISO 4217 code
+CURRENCY_CODES = {
+    "€": "EUR", "EURO": "EUR", "EUROS": "EUR",
+    "$": "USD", "US$": "USD", "DOLLAR": "USD",
+    "£": "GBP", "PFUND": "GBP",
+    "¥": "CNY", "元": "CNY", "RMB": "CNY", "YUAN": "CNY",
+    "FR.": "CHF", "SFR": "CHF", "SFR.": "CHF", "FRANKEN": "CHF",
+}
+
+
+def parquet_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def parse_amounts(values):
+    """
+    Amounts as the model wrote them, "150.08", 150.08, "1.234,56 €", "ca. 150"
+    or "150,-", to exact cents. The last separator followed by one or two
+    digits is the decimal point, a dot followed by groups of three digits only
+    is the German thousands separator.
+    :param values: pandas Series of raw amounts
+    :return: nullable Int64 Series of cents, <NA> where nothing could be read
+    """
+    import pandas as pd
+
+    text = values.astype("string").str.strip()
+    text = text.str.replace(r"^[^\W\d_]+\.?\s*", "", regex=True)   # "ca. 150", "EUR 150"
+    text = text.str.replace(r"[,.]-+$", "", regex=True)             # "150,-"
+    text = text.str.replace(r"[^\d,.\-]", "", regex=True)           # currency, spaces and apostrophes
+    # a separator in front is left over from text around the number, ".150" is no amount
+    text = text.mask(text.str.match(r"-?[,.]").fillna(False))
+    last_comma = text.str.rfind(",")
+    last_dot = text.str.rfind(".")
+    comma_decimal = ((last_comma > last_dot) & ~text.str.fullmatch(r"-?\d{1,3}(,\d{3})+")).fillna(False)
+    dot_grouping = ((last_comma < 0) & text.str.fullmatch(r"-?\d{1,3}(\.\d{3})+")).fillna(False)
+
+    german = text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    text = text.where(~comma_decimal, german)
+    text = text.where(~dot_grouping, text.str.replace(".", "", regex=False))
+    text = text.where(comma_decimal, text.str.replace(",", "", regex=False))
+    numbers = pd.to_numeric(text, errors="coerce")
+    return (numbers * 100).round().astype("Int64")
+
+
+def parse_dates(values):
+    """
+    Dates like "16-10-2024", "16.10.2024" or "2024-10-16", a time after the date is ignored.
+    :return: datetime64 Series, NaT where nothing could be read
+    """
+    import pandas as pd
+
+    text = values.astype("string").str.replace(r"[./]", "-", regex=True)
+    text = text.str.extract(r"(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}-\d{1,2}-\d{4})", expand=False)
+    day_first = pd.to_datetime(text, format="%d-%m-%Y", errors="coerce")
+    iso = pd.to_datetime(text, format="%Y-%m-%d", errors="coerce")
+    return day_first.fillna(iso)
+
+
+def parse_currencies(currencies, amounts):
+    """
+    ISO 4217 codes of the currencies, a symbol left in the amount is used if the currency is missing.
+    :return: string Series, <NA> for unknown currencies
+    """
+    text = currencies.astype("string").str.strip().str.upper().replace(CURRENCY_CODES)
+    symbol = amounts.astype("string").str.extract(r"([€$£¥])", expand=False).replace(CURRENCY_CODES)
+    return text.where(text.str.fullmatch(r"[A-Z]{3}").fillna(False), symbol)
+
+
+def normalize_payments(frame):
+    """
+    Typed columns of a frame read with PAYMENTS_SELECT, column by column without a python loop per row.
+    :return: (frame with PAYMENT_COLUMNS, dict with the number of values which could not be read)
+    """
+    import pandas as pd
+
+    raw = frame.mask(frame.isin(MISSING_VALUES))
+    result = pd.DataFrame({
+        "amount_id": raw["amount_id"].astype("int64"),
+        "document_id": raw["document_id"].astype("int64"),
+        "title": raw["title"].astype("string"),
+        "reference_number": raw["reference_number"].astype("string"),
+        "language": raw["language"].astype("string").str.strip().str.lower(),
+        "document_date": parse_dates(raw["document_date"]),
+        "transfer_deadline": parse_dates(raw["transfer_deadline"]),
+    })
+    result["amount_cents"] = parse_amounts(raw["amount"])
+    result["amount"] = result["amount_cents"].astype("Float64") / 100
+    result["currency"] = parse_currencies(raw["currency"], raw["amount"])
+    result["bank_name"] = raw["bank_name"].astype("string")
+    result["account_number"] = raw["account_number"].astype("string").str.replace(r"\s", "", regex=True).str.upper()
+    result["account_holder"] = raw["account_holder"].astype("string")
+    counterparties = raw["counterparties"].astype("string")
+    result["counterparties"] = counterparties.mask(counterparties.eq("[]"))
+
+    unread = {
+        "amount": int((raw["amount"].notna() & result["amount_cents"].isna()).sum()),
+        "document_date": int((raw["document_date"].notna() & result["document_date"].isna()).sum()),
+        "transfer_deadline": int((raw["transfer_deadline"].notna() & result["transfer_deadline"].isna()).sum()),
+    }
+    return result[list(PAYMENT_COLUMNS)], unread
+
+
+class PaymentExport:
+
+    def __init__(self, db_path, output_dir=None, batch_rows=50000):
+        """
+        Incremental export of the amounts, deadlines and counterparties as typed
+        columns for the reports. Writes a Parquet file per batch if pyarrow is
+        installed and output_dir is given, the export_payments table otherwise.
+        The last exported amount id is kept in export_watermark, a run only
+        reads the rows added since.
+        :param db_path: Path to the directory of the database file
+        :param output_dir: directory of the Parquet files, None for the shadow table
+        :param batch_rows: rows read, converted and written at once
+        """
+        self.db_path = os.path.join(db_path, "Documents.db")
+        self.output_dir = output_dir
+        self.batch_rows = batch_rows
+        self.connection = None
+        if output_dir and not parquet_available():
+            logging.warning("pyarrow is not installed, exporting into the export_payments table instead")
+            self.output_dir = None
+        self.target = f"parquet:{os.path.abspath(output_dir)}" if self.output_dir else "export_payments"
+
+    def connect(self):
+        """
+        Open an own connection, the pipeline may be writing at the same time.
+        The tables are created by DatabaseManager.connect.
+        """
+        self.connection = sqlite3.connect(self.db_path, timeout=30)
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+
+    def watermark(self):
+        row = self.connection.execute("SELECT last_id FROM export_watermark WHERE name = ?;",
+                                      (self.target,)).fetchone()
+        return row[0] if row else 0
+
+    def _set_watermark(self, last_id, rows):
+        self.connection.execute("""
+        INSERT INTO export_watermark (name, last_id, rows, exported_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id, rows = export_watermark.rows + excluded.rows,
+                                        exported_at = excluded.exported_at;
+        """, (self.target, last_id, rows, time.time()))
+
+    def run(self):
+        """
+        Export everything above the watermark, one batch after the other.
+        :return: stats of the run
+        """
+        import pandas as pd
+
+        stats = {"target": self.target, "rows": 0, "batches": 0, "unread": {}, "seconds": 0.0}
+        start = time.perf_counter()
+        last_id = self.watermark()
+        while True:
+            frame = pd.read_sql_query(PAYMENTS_SELECT, self.connection, params=(last_id, self.batch_rows))
+            if frame.empty:
+                break
+            payments, unread = normalize_payments(frame)
+            first_id, last_id = int(payments["amount_id"].iloc[0]), int(payments["amount_id"].iloc[-1])
+            if self.output_dir:
+                self._write_parquet(payments, first_id)
+                with self.connection:
+                    self._set_watermark(last_id, len(payments))
+            else:
+                # rows and watermark in one transaction, an interrupted run leaves neither
+                with self.connection:
+                    self._write_table(payments)
+                    self._set_watermark(last_id, len(payments))
+            stats["rows"] += len(payments)
+            stats["batches"] += 1
+            for column, count in unread.items():
+                stats["unread"][column] = stats["unread"].get(column, 0) + count
+            if len(frame) < self.batch_rows:
+                break
+        stats["seconds"] = time.perf_counter() - start
+        stats["watermark"] = last_id
+        return stats
+
+    def _write_parquet(self, payments, first_id):
+        """
+        One file per batch named after its first amount id. A run that stopped
+        before the watermark was saved starts again at the same id, so the retry
+        replaces the file instead of duplicating the rows, also when rows were
+        added in between and the batch ends later.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(payments, preserve_index=False)
+        for name in ("document_date", "transfer_deadline"):
+            table = table.set_column(table.schema.get_field_index(name), name, table[name].cast(pa.date32()))
+        # exact decimal from the cents, a float would round 0.1 + 0.2
+        cents = payments["amount_cents"]
+        units = cents.abs() // 100
+        decimals = ((cents < 0).map({True: "-", False: ""}).astype("string") + units.astype("string") + "."
+                    + (cents.abs() % 100).astype("string").str.zfill(2))
+        amount = pa.array(decimals, type=pa.string(), from_pandas=True).cast(pa.decimal128(18, 2))
+        table = table.set_column(table.schema.get_field_index("amount"), "amount", amount)
+        # the pandas metadata still describes the float column
+        table = table.replace_schema_metadata(None)
+
+        directory = os.path.join(self.output_dir, "payments")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{first_id:012d}.parquet")
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        logging.info(f"exported {len(payments)} payments to {path}")
+
+    def _write_table(self, payments):
+        """rows into the typed shadow table, dates as ISO text, which sqlite compares and sorts correctly"""
+        rows = payments.copy()
+        for name in ("document_date", "transfer_deadline"):
+            rows[name] = rows[name].dt.strftime("%Y-%m-%d")
+        rows = rows.astype(object).where(rows.notna(), None)
+        placeholders = ", ".join("?" for _ in PAYMENT_COLUMNS)
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO export_payments ({', '.join(PAYMENT_COLUMNS)}) VALUES ({placeholders});",
+            rows.itertuples(index=False, name=None))
+        logging.info(f"exported {len(payments)} payments to export_payments")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="export the amounts, deadlines and counterparties as typed columns")
+    parser.add_argument("--db-path", default=os.environ.get("DB_PATH"), help="directory of Documents.db")
+    parser.add_argument("--output", default=os.environ.get("EXPORT_DIRECTORY"),
+                        help="directory of the Parquet files, without it the export_payments table is filled")
+    parser.add_argument("--batch-rows", type=int, default=50000, help="rows converted and written at once")
+    args = parser.parse_args(argv)
+    if not args.db_path:
+        parser.error("--db-path is required")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from Database.DBHandler import DatabaseManager
+
+    # creates the export tables in a database of an older version
+    db_manager = DatabaseManager(args.db_path)
+    db_manager.connect()
+    db_manager.close()
+
+    export = PaymentExport(args.db_path, args.output, batch_rows=args.batch_rows)
+    export.connect()
+    try:
+        stats = export.run()
+    finally:
+        export.close()
+    logging.info(f"export: {stats}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import sqlite3
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from Database.CacheHandler import ResultCache
+
+# states of a job in processing order, moved and failed are final
+STATES = ("queued", "extracted", "summarized", "stored", "moved", "failed")
+
+class JobQueue:
+
+    def __init__(self, db_path, lease_seconds=600, max_attempts=3, owner=None):
+        """
+        Persistent job table in Documents.db. Every file gets a job whose state
+        and intermediate results are checkpointed after each stage, so several
+        processes can share the work and a restart resumes instead of starting over.
+        :param db_path: Path to the directory of the database file
+        :param lease_seconds: a job leased longer than this without checkpoint is taken over by others
+        :param max_attempts: number of leases before a job is marked failed
+        :param owner: lease owner name, defaults to host:pid, which lets other processes of the host
+                      take over the leases as soon as this process is gone
+        """
+        self.db_path = os.path.join(db_path, "Documents.db")
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """
+        Open an own connection, the jobs are updated from all pipeline threads.
+        The table itself is created by DatabaseManager.connect.
+        """
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+
+    @contextmanager
+    def _write(self):
+        """serialize writers of this process and hold the database write lock"""
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE;")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.rollback()
+                raise
+            else:
+                self.connection.commit()
+
+    def enqueue(self, file_path, retry_failed=False):
+        """
+        Add a job for the file, an active job for the same path is reused.
+        A file whose last job failed is not processed again while its content
+        is the same, lease skips the returned failed job. A file changed since,
+        e.g. a corrected scan saved under the same name, or retry_failed get a new job.
+        :return: the job id
+        """
+        now = time.time()
+        mtime, size = self._stat(file_path)
+        with self._write() as connection:
+            row = connection.execute(
+                "SELECT id, state, file_hash, file_mtime, file_size FROM jobs WHERE file_path = ? "
+                "ORDER BY id DESC LIMIT 1;", (file_path,)).fetchone()
+            # after a moved job the path holds a new file
+            if row is not None and row["state"] not in ("moved", "failed"):
+                return row["id"]
+            if row is not None and row["state"] == "failed" and not retry_failed and \
+                    self._unchanged(row, file_path, mtime, size):
+                logging.warning(f"job {row['id']} for {file_path} failed before and the file did not change, "
+                                f"not processed again")
+                return row["id"]
+            cursor = connection.execute(
+                "INSERT INTO jobs (file_path, state, attempts, file_mtime, file_size, created_at, updated_at) "
+                "VALUES (?, 'queued', 0, ?, ?, ?, ?);", (file_path, mtime, size, now, now))
+            return cursor.lastrowid
+
+    @staticmethod
+    def _stat(file_path):
+        """modification time and size of the file, None for a missing file"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None, None
+        return stat.st_mtime, stat.st_size
+
+    @staticmethod
+    def _unchanged(row, file_path, mtime, size):
+        """True if the file still has the content the job was made for"""
+        if mtime is None or (row["file_mtime"], row["file_size"]) == (mtime, size):
+            return True
+        if row["file_hash"] is None:
+            return False
+        # touched or copied again, the content decides
+        try:
+            return ResultCache.file_hash(file_path) == row["file_hash"]
+        except OSError:
+            return True
+
+    def lease(self, job_id=None, limit=100):
+        """
+        Take jobs which are not leased, whose lease expired or whose owner was a
+        process on this host that does not exist anymore, e.g. an interrupted run.
+        Live leases are never taken over, also not from an owner of the same name.
+        :param job_id: lease only this job
+        :param limit: maximum number of jobs
+        :return: list of job rows, state and checkpoints included
+        """
+        now = time.time()
+        conditions = "state NOT IN ('moved', 'failed') AND (lease_expires IS NULL OR lease_expires < ?"
+        params = [now]
+        dead_owners = self._dead_owners(now)
+        if dead_owners:
+            conditions += f" OR lease_owner IN ({', '.join('?' for _ in dead_owners)})"
+            params += dead_owners
+        conditions += ")"
+        if job_id is not None:
+            conditions += " AND id = ?"
+            params.append(job_id)
+        with self._write() as connection:
+            rows = connection.execute(f"SELECT * FROM jobs WHERE {conditions} ORDER BY id LIMIT ?;",
+                                      params + [limit]).fetchall()
+            leased = []
+            for row in rows:
+                if row["attempts"] >= self.max_attempts:
+                    connection.execute("UPDATE jobs SET state = 'failed', updated_at = ? WHERE id = ?;",
+                                       (now, row["id"]))
+                    logging.error(f"job {row['id']} for {row['file_path']} failed after {row['attempts']} attempts: "
+                                  f"{row['last_error']}")
+                    continue
+                connection.execute(
+                    "UPDATE jobs SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?;",
+                    (self.owner, now + self.lease_seconds, now, row["id"]))
+                leased.append(row)
+        return leased
+
+    def _dead_owners(self, now):
+        """owners of live leases which are processes of this host that have exited"""
+        host = socket.gethostname()
+        with self.lock:
+            owners = [row[0] for row in self.connection.execute(
+                "SELECT DISTINCT lease_owner FROM jobs WHERE state NOT IN ('moved', 'failed') AND lease_expires >= ?;",
+                (now,))]
+        dead = []
+        for owner in owners:
+            owner_host, _, pid = (owner or "").rpartition(":")
+            if owner_host != host or not pid.isdigit() or owner == self.owner:
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                dead.append(owner)
+            except OSError:
+                pass   # exists, but belongs to another user
+        return dead
+
+    def renew(self, job_ids):
+        """extend the leases this owner holds on the jobs, e.g. while they wait in a queue or run a long OCR"""
+        if not job_ids:
+            return
+        now = time.time()
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._write() as connection:
+            connection.execute(
+                f"UPDATE jobs SET lease_expires = ? WHERE lease_owner = ? AND state NOT IN ('moved', 'failed') "
+                f"AND id IN ({placeholders});", [now + self.lease_seconds, self.owner] + list(job_ids))
+
+    def checkpoint(self, job_id, state, connection=None, **fields):
+        """
+        Record a finished stage and its results, renews the lease.
+        :param state: one of STATES
+        :param connection: write inside the transaction of this connection instead of an own one
+        :param fields: file_hash, extracted_text, json_str, usage, document_id, link_target
+        """
+        if "usage" in fields:
+            fields["usage_json"] = json.dumps(fields.pop("usage"))
+        now = time.time()
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        sql = f"UPDATE jobs SET state = ?, lease_expires = ?, updated_at = ?{', ' if columns else ''}{columns} WHERE id = ?;"
+        params = (state, now + self.lease_seconds, now) + tuple(fields.values()) + (job_id,)
+        if connection is not None:
+            connection.execute(sql, params)
+            return
+        with self._write() as own_connection:
+            own_connection.execute(sql, params)
+
+    def finish(self, job_id):
+        """mark a job moved and drop the checkpoints, the document table holds the results now"""
+        now = time.time()
+        with self._write() as connection:
+            connection.execute(
+                """
+                UPDATE jobs SET state = 'moved', extracted_text = NULL, json_str = NULL,
+                                lease_owner = NULL, lease_expires = NULL, updated_at = ?
+                WHERE id = ?;
+                """, (now, job_id))
+
+    def fail(self, job_id, error, final=False):
+        """
+        Record an error and give the lease back, the job is retried until max_attempts.
+        :param final: the error can not be fixed by a retry
+        """
+        now = time.time()
+        with self._write() as connection:
+            connection.execute(
+                """
+                UPDATE jobs SET last_error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?,
+                                state = CASE WHEN ? OR attempts >= ? THEN 'failed' ELSE state END
+                WHERE id = ?;
+                """, (str(error), now, bool(final), self.max_attempts, job_id))
+
+    def counts(self):
+        """number of jobs per state"""
+        with self.lock:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state;").fetchall()
+        return {state: count for state, count in rows}
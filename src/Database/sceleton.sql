@@ -7,7 +7,8 @@ CREATE TABLE IF NOT EXISTS documents (
     language VARCHAR(50),
     timestamp DATE,
     link_original VARCHAR(255),
-    json_str TEXT
+    json_str TEXT,
+    extracted_text TEXT
 );
 
 -- sub table：bank_info
@@ -26,6 +27,7 @@ CREATE TABLE IF NOT EXISTS amount (
     id INTEGER PRIMARY KEY,
     currency VARCHAR(10),
     value VARCHAR(50),
+    value_cents INTEGER,
     bank_info_id INT,
     FOREIGN KEY (bank_info_id) REFERENCES bank_info(id)
 );
@@ -61,3 +63,123 @@ CREATE TABLE IF NOT EXISTS recipients (
     document_id INT,
     FOREIGN KEY (document_id) REFERENCES documents(id)
 );
+
+-- sub table：llm_usage
+CREATE TABLE IF NOT EXISTS llm_usage (
+    id INTEGER PRIMARY KEY,
+    chunks INT,
+    pages INT,
+    prompt_tokens INT,
+    completion_tokens INT,
+    latency_seconds REAL,
+    document_id INT,
+    FOREIGN KEY (document_id) REFERENCES documents(id)
+);
+
+-- indexes：foreign keys and lookup columns
+CREATE INDEX IF NOT EXISTS idx_documents_reference_number ON documents(reference_number);
+CREATE INDEX IF NOT EXISTS idx_documents_timestamp ON documents(timestamp);
+CREATE INDEX IF NOT EXISTS idx_bank_info_document_id ON bank_info(document_id);
+CREATE INDEX IF NOT EXISTS idx_bank_info_iban ON bank_info(REPLACE(UPPER(account_number), ' ', ''));
+CREATE INDEX IF NOT EXISTS idx_bank_info_account_holder ON bank_info(account_holder COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_amount_bank_info_id ON amount(bank_info_id);
+CREATE INDEX IF NOT EXISTS idx_amount_value_cents ON amount(value_cents);
+CREATE INDEX IF NOT EXISTS idx_related_info_document_id ON related_info(document_id);
+CREATE INDEX IF NOT EXISTS idx_related_info_name ON related_info(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_related_info_company ON related_info(company COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_address_related_info_id ON address(related_info_id);
+CREATE INDEX IF NOT EXISTS idx_recipients_document_id ON recipients(document_id);
+CREATE INDEX IF NOT EXISTS idx_llm_usage_document_id ON llm_usage(document_id);
+
+-- full text search：title, summary and extracted text of documents, kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    title,
+    summary,
+    extracted_text,
+    content='documents',
+    content_rowid='id'
+);
+
+CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents BEGIN
+    INSERT INTO documents_fts (rowid, title, summary, extracted_text)
+    VALUES (new.id, new.title, new.summary, new.extracted_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents BEGIN
+    INSERT INTO documents_fts (documents_fts, rowid, title, summary, extracted_text)
+    VALUES ('delete', old.id, old.title, old.summary, old.extracted_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE ON documents BEGIN
+    INSERT INTO documents_fts (documents_fts, rowid, title, summary, extracted_text)
+    VALUES ('delete', old.id, old.title, old.summary, old.extracted_text);
+    INSERT INTO documents_fts (rowid, title, summary, extracted_text)
+    VALUES (new.id, new.title, new.summary, new.extracted_text);
+END;
+
+-- cache：extraction and summary results keyed by content hash
+CREATE TABLE IF NOT EXISTS result_cache (
+    file_hash CHAR(64) PRIMARY KEY,
+    text_hash CHAR(64),
+    extracted_text TEXT,
+    json_str TEXT,
+    size_bytes INT,
+    created_at REAL,
+    last_hit REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_result_cache_text_hash ON result_cache(text_hash);
+CREATE INDEX IF NOT EXISTS idx_result_cache_last_hit ON result_cache(last_hit);
+
+-- job queue：processing state of every file, checkpoints let a restart resume from the last finished stage
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    file_path VARCHAR(1024),
+    state VARCHAR(20),
+    file_hash CHAR(64),
+    file_mtime REAL,
+    file_size INT,
+    extracted_text TEXT,
+    json_str TEXT,
+    usage_json TEXT,
+    document_id INT,
+    link_target VARCHAR(1024),
+    attempts INT DEFAULT 0,
+    last_error TEXT,
+    lease_owner VARCHAR(255),
+    lease_expires REAL,
+    created_at REAL,
+    updated_at REAL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_file ON jobs(file_path) WHERE state NOT IN ('moved', 'failed');
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, lease_expires);
+
+-- analytics export：typed copy of the amounts for the reports, filled by Database/Export.py without pyarrow
+CREATE TABLE IF NOT EXISTS export_payments (
+    amount_id INTEGER PRIMARY KEY,
+    document_id INT,
+    title TEXT,
+    reference_number VARCHAR(255),
+    language VARCHAR(50),
+    document_date DATE,
+    transfer_deadline DATE,
+    amount REAL,
+    amount_cents INTEGER,
+    currency CHAR(3),
+    bank_name VARCHAR(255),
+    account_number VARCHAR(255),
+    account_holder VARCHAR(255),
+    counterparties TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_export_payments_deadline ON export_payments(transfer_deadline);
+CREATE INDEX IF NOT EXISTS idx_export_payments_document_date ON export_payments(document_date);
+
+-- export watermark：highest amount id every export target has written
+CREATE TABLE IF NOT EXISTS export_watermark (
+    name VARCHAR(1024) PRIMARY KEY,
+    last_id INT,
+    rows INT,
+    exported_at REAL
+);
@@ -1,28 +1,71 @@
 import os
 import sys
-import shutil
+import json
+import time
+_IMPORT_START = time.perf_counter()
 import logging
+import resource
 from datetime import datetime
 from inotify_simple import INotify, flags
-from TextExtractor import TextExtractor
-from chatGPT import AIAssistant
+from chatGPT import SummaryService
 from Database.DBHandler import DatabaseManager
+from Database.CacheHandler import ResultCache
+from Database.JobQueue import JobQueue
+from Pipeline import DocumentPipeline
+from FileIntake import FileIntake
+from Metrics import METRICS, start_metrics_server
+# nothing above may import the OCR stack, it is loaded by the extraction workers on demand
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+HEAVY_MODULES = ("torch", "easyocr", "fitz", "cv2", "langdetect")
 
 class DocumentReader:
-    def __init__(self, watch_directory, handled_directory, temp_file, key_path, db_path, log_path):
+    def __init__(self, watch_directory, handled_directory, temp_file, key_path, db_path, log_path,
+                 extract_workers=None, documents_per_worker=2, llm_workers=4, queue_size=16, settle_seconds=2.0,
+                 dpi=200, grayscale=True, cache_max_mb=512, cache_max_age_days=90,
+                 db_synchronous="NORMAL", db_cache_size_kb=65536,
+                 llm_base_url=None, llm_requests_per_minute=500, llm_tokens_per_minute=200000, llm_timeout=60.0,
+                 llm_chunk_tokens=4000, llm_structured_output=True, metrics_port=None,
+                 job_lease_seconds=600, job_max_attempts=3, resume_interval=60.0, preprocess=True, preprocess_profiles=None, warm_up_languages=None):
         self.watch_directory = watch_directory
         self.handled_directory = handled_directory
         self.inotify = INotify()
         self.watch_flags = flags.CLOSE_WRITE | flags.MOVED_TO
         self.temp = temp_file
+        self.intake = FileIntake(settle_seconds=settle_seconds)
+        self.metrics_port = metrics_port
+        self.resume_interval = resume_interval
+        self.warm_up_languages = warm_up_languages
+        self.startup = {"imports": IMPORT_SECONDS}
+        start = time.perf_counter()
         with open(key_path, "r") as file:
             self.key = file.read()
         
-        self.dbManager = DatabaseManager(db_path)
+        self.dbManager = DatabaseManager(db_path, synchronous=db_synchronous, cache_size_kb=db_cache_size_kb)
         self.dbManager.connect()
+        self.cache = ResultCache(db_path, max_size_mb=cache_max_mb, max_age_days=cache_max_age_days)
+        self.cache.connect()
+        self.jobs = JobQueue(db_path, lease_seconds=job_lease_seconds, max_attempts=job_max_attempts)
+        self.jobs.connect()
+        self.startup["database"] = time.perf_counter() - start
 
         # Set up logging
         self.setup_logging(log_path)
+
+        start = time.perf_counter()
+        # one long-lived, pooled LLM client for all documents
+        self.summary_service = SummaryService(self.key, base_url=llm_base_url, max_concurrency=llm_workers,
+                                              requests_per_minute=llm_requests_per_minute,
+                                              tokens_per_minute=llm_tokens_per_minute, timeout=llm_timeout,
+                                              max_chunk_tokens=llm_chunk_tokens,
+                                              structured_output=llm_structured_output)
+        self.pipeline = DocumentPipeline(self.dbManager, self.summary_service.summarize_document,
+                                         self.handled_directory, self.temp,
+                                         extract_workers=extract_workers, llm_workers=llm_workers,
+                                         documents_per_worker=documents_per_worker,
+                                         queue_size=queue_size, dpi=dpi, grayscale=grayscale,
+                                         cache=self.cache, jobs=self.jobs, preprocess=preprocess,
+                                         preprocess_profiles=preprocess_profiles)
+        self.startup["services"] = time.perf_counter() - start
         
     def get_env_var(self):
         self.watch_directory = os.getenv(WATCH_DIRECTORY)
@@ -51,76 +94,87 @@ class DocumentReader:
             format='%(asctime)s - %(levelname)s - %(message)s'
         )
     
+    def report_startup(self):
+        """log how long the start took and what it cost, also exported as metrics"""
+        self.startup["total"] = sum(self.startup.values())
+        for phase, seconds in self.startup.items():
+            METRICS.gauge("docreader_startup_seconds", lambda seconds=seconds: round(seconds, 3), phase=phase)
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        loaded = [module for module in HEAVY_MODULES if module in sys.modules]
+        logging.info("startup " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup.items()) +
+                     f", peak rss {rss_mb:.0f} MB, heavy modules loaded: {loaded or 'none'}")
+
     def check_directory(self):
-        """Check the directory and process new files"""
+        """One-time startup sweep: queue the files which arrived while the service was down"""
         files_in_directory = os.listdir(self.watch_directory)
-        extracted_text = None
-        text = None
 
         # Check if the directory is empty
         if not files_in_directory:
             logging.info(f"The directory '{self.watch_directory}' is empty.")
             return
 
-        # Process each file based on its extension
         for filename in files_in_directory:
             # Build the full file path
             file_path = os.path.join(self.watch_directory, filename)
-            # Process the file based on its extension
-            if filename.lower().endswith('.pdf'):
-                text_extractor = TextExtractor(file_path, self.temp)
-                extracted_text = text_extractor.extract_text_from_pdf()
-                logging.info(f"text has been extracted from pdf")
-            elif filename.lower().endswith('.txt'):
-                text_extractor = TextExtractor(file_path, self.temp)
-                extracted_text = text_extractor.extract_text_from_txt()
-                logging.info(f"text has been extracted from txt file")
-            elif filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                text_extractor = TextExtractor(file_path, self.temp)
-                extracted_text = text_extractor.extract_text_from_image()
-                logging.info(f"text has been extracted from image")
-            else:
-                logging.info(f"unknow format document")
-                
-            ai_assistant = AIAssistant(self.key)
-            if not extracted_text:
-                logging.info(f"nothing in extracted_text")
-                return
-            else:
-                text = ai_assistant.JsonFormatSummary(extracted_text)
-                logging.info(f"get json format summary")
-            
-            text = text.replace("'", '"') # repair the problem caused by fine-tuning
-            text = text.replace("None", '"N/A"')
-            extension = os.path.splitext(filename)[1][1:].upper()  # Get extension and remove the dot
-            extension_dir = os.path.join(self.handled_directory, extension)
-            if not os.path.exists(extension_dir):
-                os.makedirs(extension_dir)
-            
-            try:
-                self.dbManager.insert_new_element(json_str=text, link=os.path.join(extension_dir, filename))
-            except Exception as e:
-                logging.error("insert_new_element error: %s", e)
-            
-            shutil.move(file_path, os.path.join(extension_dir, filename))
-            logging.info(f"Moved file: {filename} to {extension_dir}")
+            if os.path.isfile(file_path):
+                self.intake.add(file_path)
+        logging.info(f"startup sweep queued {len(self.intake)} files")
+
+    def handle_events(self, events):
+        """Queue the files named by the inotify events"""
+        for event in events:
+            if event.mask & flags.ISDIR or not event.name:
+                continue
+            if event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                self.intake.add(os.path.join(self.watch_directory, event.name))
+
+    def submit_settled(self):
+        """Hand the files which stopped changing to the pipeline"""
+        for file_path in self.intake.ready():
+            self.pipeline.submit(file_path)
 
     def run(self):
         """Run the document reader service"""
         
         try:    
-            self.inotify.add_watch(self.watch_directory, self.watch_flags)    
+            start = time.perf_counter()
+            self.summary_service.start()
+            self.pipeline.start()
+            if self.metrics_port:
+                start_metrics_server(port=self.metrics_port)
+            self.inotify.add_watch(self.watch_directory, self.watch_flags)
+            self.startup["watch"] = time.perf_counter() - start
             logging.info("Starting directory watch service...")
+            self.report_startup()
+            if self.warm_up_languages:
+                # the watcher is live already, the models load in the background
+                self.pipeline.warm_up(self.warm_up_languages)
+            # continue the jobs a previous run left unfinished
+            self.pipeline.resume()
+            # watch first, then sweep, so no file falls between the two
+            self.check_directory()
+            next_resume = time.monotonic() + self.resume_interval
 
             while True:
-                for event in self.inotify.read():
-                    for flag in flags.from_mask(event.mask):
-                        if flag == flags.CLOSE_WRITE or flags.MOVED_TO:
-                            self.check_directory()
-                            
+                # wake up in time to release files whose settle window ends or to retry failed jobs
+                timeout = max(0.0, next_resume - time.monotonic())
+                settle_timeout = self.intake.next_timeout()
+                if settle_timeout is not None:
+                    timeout = min(timeout, settle_timeout)
+                events = self.inotify.read(timeout=int(timeout * 1000) + 1)
+                self.handle_events(events)
+                self.submit_settled()
+                if time.monotonic() >= next_resume:
+                    self.pipeline.resume()
+                    next_resume = time.monotonic() + self.resume_interval
+
         except KeyboardInterrupt:
             logging.info("Exiting the document reader service...")
             print(f"Exiting the document reader service...")
+            self.pipeline.shutdown()
+            self.summary_service.close()
+            self.cache.close()
+            self.jobs.close()
             self.dbManager.close()
             exit(0) 
 
@@ -132,6 +186,33 @@ if __name__ == '__main__':
     KEY_PATH = os.environ.get("KEY_PATH")
     DB_PATH = os.environ.get("DB_PATH")
     LOG_PATH = os.environ.get("LOG_PATH")
+    # optional tuning of the pipeline
+    EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", os.cpu_count() or 1))
+    # documents every extraction process works on at once, their scanned pages share the OCR batches
+    EXTRACT_DOCUMENTS_PER_WORKER = int(os.environ.get("EXTRACT_DOCUMENTS_PER_WORKER", 2))
+    LLM_WORKERS = int(os.environ.get("LLM_WORKERS", 4))
+    QUEUE_SIZE = int(os.environ.get("QUEUE_SIZE", 16))
+    SETTLE_SECONDS = float(os.environ.get("SETTLE_SECONDS", 2.0))
+    OCR_DPI = int(os.environ.get("OCR_DPI", 200))
+    OCR_GRAYSCALE = os.environ.get("OCR_GRAYSCALE", "1") != "0"
+    OCR_PREPROCESS = os.environ.get("OCR_PREPROCESS", "1") != "0"
+    # e.g. "de,en" loads these OCR models in the background after start, disabled if unset
+    OCR_WARMUP = [language for language in os.environ.get("OCR_WARMUP", "").split(",") if language]
+    # e.g. {"photo": {"target_text_height": 36}}, see Preprocess.PROFILES
+    PREPROCESS_PROFILES = json.loads(os.environ.get("PREPROCESS_PROFILES", "{}"))
+    CACHE_MAX_MB = float(os.environ.get("CACHE_MAX_MB", 512))
+    CACHE_MAX_AGE_DAYS = float(os.environ.get("CACHE_MAX_AGE_DAYS", 90))
+    DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+    DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", 65536))
+    LLM_BASE_URL = os.environ.get("LLM_BASE_URL")   # e.g. a local MockLLMServer
+    LLM_RPM = int(os.environ.get("LLM_RPM", 500))
+    LLM_TPM = int(os.environ.get("LLM_TPM", 200000))
+    LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 60))
+    LLM_CHUNK_TOKENS = int(os.environ.get("LLM_CHUNK_TOKENS", 4000))
+    LLM_STRUCTURED_OUTPUT = os.environ.get("LLM_STRUCTURED_OUTPUT", "1") != "0"
+    METRICS_PORT = int(os.environ.get("METRICS_PORT", 0)) or None   # e.g. 9100, disabled if unset
+    JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 600))
+    JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
     
     # check if all env variables are set
     if any(var is None for var in [WATCH_DIRECTORY, HANDLED_DIRECTORY, TEMP_PATH, KEY_PATH, DB_PATH, LOG_PATH]):
@@ -139,7 +220,19 @@ if __name__ == '__main__':
         sys.exit(1)  # exit with error 1
     
     # Create an instance of DocumentReader
-    reader = DocumentReader(WATCH_DIRECTORY, HANDLED_DIRECTORY, TEMP_PATH, KEY_PATH, DB_PATH, LOG_PATH)
+    reader = DocumentReader(WATCH_DIRECTORY, HANDLED_DIRECTORY, TEMP_PATH, KEY_PATH, DB_PATH, LOG_PATH,
+                            extract_workers=EXTRACT_WORKERS, documents_per_worker=EXTRACT_DOCUMENTS_PER_WORKER,
+                            llm_workers=LLM_WORKERS, queue_size=QUEUE_SIZE,
+                            settle_seconds=SETTLE_SECONDS, dpi=OCR_DPI, grayscale=OCR_GRAYSCALE,
+                            cache_max_mb=CACHE_MAX_MB, cache_max_age_days=CACHE_MAX_AGE_DAYS,
+                            db_synchronous=DB_SYNCHRONOUS, db_cache_size_kb=DB_CACHE_SIZE_KB,
+                            llm_base_url=LLM_BASE_URL, llm_requests_per_minute=LLM_RPM,
+                            llm_tokens_per_minute=LLM_TPM, llm_timeout=LLM_TIMEOUT,
+                            llm_chunk_tokens=LLM_CHUNK_TOKENS, llm_structured_output=LLM_STRUCTURED_OUTPUT,
+                            metrics_port=METRICS_PORT,
+                            job_lease_seconds=JOB_LEASE_SECONDS, job_max_attempts=JOB_MAX_ATTEMPTS,
+                            preprocess=OCR_PREPROCESS, preprocess_profiles=PREPROCESS_PROFILES,
+                            warm_up_languages=OCR_WARMUP)
 
     # Run the document reader service
     reader.run()
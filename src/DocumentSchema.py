@@ -0,0 +1,173 @@
+import re
+import ast
+import json
+from typing import Annotated, List
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError
+
+MISSING = "N/A"   # placeholder of the fine-tuned model for unknown values
+
+# markdown code fence some answers are wrapped in
+CODE_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+def _text(value):
+    """unknown values become N/A, numbers like an amount of 100.0 become text"""
+    if value is None:
+        return MISSING
+    if isinstance(value, (bool, int, float)):
+        return str(value)
+    return value
+
+
+def _as_list(value):
+    """the model answers a single person as object instead of a list of one"""
+    if value is None or value == MISSING:
+        return []
+    if isinstance(value, dict):
+        return [value]
+    return value
+
+
+def _as_object(value):
+    return value if isinstance(value, dict) else {}
+
+
+Text = Annotated[str, BeforeValidator(_text)]
+
+
+class SchemaModel(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+
+class Amount(SchemaModel):
+    currency: Text = MISSING
+    value: Text = MISSING
+
+
+class BankInfo(SchemaModel):
+    bank_name: Text = MISSING
+    account_number: Text = MISSING
+    account_holder: Text = MISSING
+    transfer_deadline: Text = MISSING
+    amount: Annotated[Amount, BeforeValidator(_as_object)] = Field(default_factory=Amount)
+
+
+class Address(SchemaModel):
+    street: Text = MISSING
+    city: Text = MISSING
+    postal_code: Text = MISSING
+    country: Text = MISSING
+
+
+class ContactInfo(SchemaModel):
+    phone: Text = MISSING
+    email: Text = MISSING
+    address: Annotated[Address, BeforeValidator(_as_object)] = Field(default_factory=Address)
+
+
+class RelatedParty(SchemaModel):
+    name: Text = MISSING
+    company: Text = MISSING
+    position: Text = MISSING
+    contact_info: Annotated[ContactInfo, BeforeValidator(_as_object)] = Field(default_factory=ContactInfo)
+
+
+class Recipient(SchemaModel):
+    name: Text = MISSING
+    email: Text = MISSING
+
+
+class DocumentSummary(SchemaModel):
+    """answer of the model for one document, the layout DatabaseManager.build_document_graph reads"""
+    title: Text = MISSING
+    summary: Text = MISSING
+    reference_number: Text = MISSING
+    language: Text = MISSING
+    timestamp: Text = MISSING
+    bank_info: Annotated[BankInfo, BeforeValidator(_as_object)] = Field(default_factory=BankInfo)
+    related_companies_or_people: Annotated[List[RelatedParty], BeforeValidator(_as_list)] = Field(default_factory=list)
+    recipients: Annotated[List[Recipient], BeforeValidator(_as_list)] = Field(default_factory=list)
+
+
+class SummaryValidationError(ValueError):
+    """model answer that does not match DocumentSummary, raw holds the answer"""
+
+    def __init__(self, message, raw):
+        super().__init__(message)
+        self.raw = raw
+
+
+def describe(error):
+    """short text of the first validation errors, used in the correction request"""
+    return "; ".join(f"{'.'.join(str(part) for part in detail['loc']) or 'answer'}: {detail['msg']}"
+                     for detail in error.errors()[:5])
+
+
+def parse_summary(text):
+    """
+    Validate a model answer. Valid json goes straight through the pydantic
+    parser, only answers that fail are repaired: code fences are removed and
+    python literals with single quotes and None are read with ast.literal_eval,
+    which leaves apostrophes and the word None in the content intact.
+    :raises SummaryValidationError: if the answer can not be read as DocumentSummary
+    """
+    try:
+        return DocumentSummary.model_validate_json(text)
+    except ValidationError as error:
+        first_error = error
+
+    candidate = CODE_FENCE.sub("", text)
+    try:
+        data = json.loads(candidate)
+    except ValueError:
+        try:
+            data = ast.literal_eval(candidate)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            raise SummaryValidationError(f"no json object: {describe(first_error)}", text) from first_error
+    try:
+        return DocumentSummary.model_validate(data)
+    except ValidationError as error:
+        raise SummaryValidationError(describe(error), text) from error
+
+
+def _strict(node):
+    """adapt a pydantic json schema to the strict structured output subset of OpenAI"""
+    if isinstance(node, list):
+        for item in node:
+            _strict(item)
+        return node
+    if not isinstance(node, dict):
+        return node
+    node.pop("default", None)
+    node.pop("title", None)
+    if len(node.get("allOf", ())) == 1:
+        # a model field with a default is wrapped in allOf, strict mode wants the plain reference
+        node.update(node.pop("allOf")[0])
+    for key, value in node.items():
+        if key in ("properties", "$defs"):
+            for child in value.values():
+                _strict(child)
+        else:
+            _strict(value)
+    if "properties" in node:
+        node["required"] = list(node["properties"])
+        node["additionalProperties"] = False
+    return node
+
+
+_response_format = None
+
+
+def response_format():
+    """response_format of the chat completion that makes the model answer in the DocumentSummary schema"""
+    global _response_format
+    if _response_format is None:
+        _response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "document_summary",
+                "strict": True,
+                "schema": _strict(DocumentSummary.model_json_schema()),
+            },
+        }
+    return _response_format
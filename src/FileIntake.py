@@ -0,0 +1,67 @@
+import os
+import time
+import threading
+
+
+class FileIntake:
+    """
+    Collects watcher events per file path and releases a file once it has
+    stopped changing for the settle window. Repeated events for the same path
+    only refresh its entry, so every file is handed on once.
+    """
+
+    def __init__(self, settle_seconds=2.0):
+        """
+        :param settle_seconds: time without new events and without size/mtime change before a file is ready
+        """
+        self.settle_seconds = settle_seconds
+        self._pending = {}   # path -> (time of last change, (size, mtime_ns))
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat(file_path):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def add(self, file_path, now=None):
+        """register an event for the path, restarts its settle window"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._pending[file_path] = (now, self._stat(file_path))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def ready(self, now=None):
+        """
+        Return the paths which settled and remove them from the intake.
+        Files that vanished are dropped, files that still change get a new window.
+        """
+        now = time.monotonic() if now is None else now
+        settled = []
+        with self._lock:
+            for file_path, (last_change, last_stat) in list(self._pending.items()):
+                if now - last_change < self.settle_seconds:
+                    continue
+                current = self._stat(file_path)
+                if current is None:
+                    del self._pending[file_path]
+                elif current != last_stat:
+                    self._pending[file_path] = (now, current)
+                else:
+                    del self._pending[file_path]
+                    settled.append(file_path)
+        return settled
+
+    def next_timeout(self, now=None):
+        """seconds until the next pending file may settle, None when nothing is pending"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not self._pending:
+                return None
+            earliest = min(last_change for last_change, _ in self._pending.values())
+        return max(0.0, earliest + self.settle_seconds - now)
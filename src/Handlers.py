@@ -0,0 +1,98 @@
+import os
+import time
+import logging
+
+# Light module on purpose: the watcher, the pipeline and the chunker import it,
+# the OCR stack (torch, easyocr, fitz, cv2, langdetect) is only imported by the
+# handlers which need it, inside the worker process that runs them.
+
+PAGE_SEPARATOR = "\f"   # form feed between the pages of a document
+
+_handlers = {}   # lower case extension -> handler(file_path, temp_file_path, options) -> (text, timings)
+
+
+def register(*extensions):
+    """decorator adding a handler for the given file extensions to the registry"""
+    def decorator(handler):
+        for extension in extensions:
+            _handlers[extension.lower()] = handler
+        return handler
+    return decorator
+
+
+def handler_for(file_path):
+    """the registered handler for the extension of the file, None for unknown formats"""
+    return _handlers.get(os.path.splitext(file_path)[1].lower())
+
+
+def supported_extensions():
+    return sorted(_handlers)
+
+
+@register(".txt")
+def extract_txt(file_path, temp_file_path, options):
+    """plain text needs no backend at all"""
+    start = time.perf_counter()
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            text = file.read().strip()
+    except (OSError, UnicodeDecodeError):
+        text = ""
+    return text, {"pages": 1, "text_layer_seconds": time.perf_counter() - start}
+
+
+@register(".pdf")
+def extract_pdf(file_path, temp_file_path, options):
+    from TextExtractor import TextExtractor
+
+    text_extractor = TextExtractor(file_path, temp_file_path, **options)
+    return text_extractor.extract_text_from_pdf(), text_extractor.timings
+
+
+@register(".jpg", ".jpeg", ".png")
+def extract_image(file_path, temp_file_path, options):
+    from TextExtractor import TextExtractor
+
+    options = {key: value for key, value in options.items() if key not in ("dpi", "grayscale")}
+    text_extractor = TextExtractor(file_path, temp_file_path, **options)
+    return text_extractor.extract_text_from_image(), text_extractor.timings
+
+
+def extract_document_traced(file_path, temp_file_path, dpi=200, grayscale=True, preprocess=True, profiles=None):
+    """
+    Extract the text of a file with the handler registered for its extension.
+    Module level so it can be sent to a worker process.
+    :return: (extracted text or None for an unknown format, timings dict of the extractor)
+    """
+    handler = handler_for(file_path)
+    if handler is None:
+        logging.info(f"unknow format document")
+        return None, {}
+    options = {"dpi": dpi, "grayscale": grayscale, "preprocess": preprocess, "profiles": profiles}
+    return handler(file_path, temp_file_path, options)
+
+
+def extract_document(file_path, temp_file_path, dpi=200, grayscale=True, preprocess=True, profiles=None):
+    """
+    Extract the text of a file based on its extension.
+    :return: the extracted text, None for an unknown format
+    """
+    return extract_document_traced(file_path, temp_file_path, dpi, grayscale, preprocess, profiles)[0]
+
+
+def warm_up_ocr(languages):
+    """
+    Import the OCR stack and load the readers for the languages in the calling
+    process, sent to the extraction workers so the first scan does not pay for it.
+    The reader of the language probe is loaded as well, every scanned page needs it.
+    :return: (pid, seconds)
+    """
+    start = time.perf_counter()
+    import TextExtractor   # fitz, cv2 and langdetect
+    from OCREngine import get_ocr_pool
+
+    pool = get_ocr_pool()
+    pool.get_reader(TextExtractor.PROBE_LANGUAGES)
+    for language in languages:
+        pool.get_reader([language])
+    return os.getpid(), time.perf_counter() - start
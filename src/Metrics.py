@@ -0,0 +1,190 @@
+import time
+import bisect
+import logging
+import threading
+from collections import deque
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATIO_BUCKETS = (0, 0.1, 0.25, 0.5, 0.75, 0.9, 1)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+class Histogram:
+    """cumulative histogram in the prometheus sense"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Counters, histograms and gauges of the running service plus the trace
+    records of the last documents. Thread safe, rendered in the prometheus
+    text format by render().
+    """
+
+    def __init__(self, recent_traces=200):
+        self.lock = threading.Lock()
+        self.counters = {}      # (name, labels) -> value
+        self.histograms = {}    # (name, labels) -> Histogram
+        self.gauges = {}        # (name, labels) -> callable
+        self.help = {}
+        self.traces = deque(maxlen=recent_traces)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def gauge(self, name, callback, **labels):
+        """register a gauge whose value is read from callback when rendered"""
+        with self.lock:
+            self.gauges[self._key(name, labels)] = callback
+
+    def record_trace(self, trace):
+        """
+        Store the trace record of one document and derive the metrics from it.
+        :param trace: dict with file, status, stage seconds, pages and tokens
+        """
+        with self.lock:
+            self.traces.append(trace)
+        self.inc("docreader_documents_total", status=trace.get("status", "unknown"))
+        for stage, seconds in trace.get("stages", {}).items():
+            self.observe("docreader_stage_seconds", seconds, stage=stage)
+        for seconds in trace.get("ocr_page_seconds", []):
+            self.observe("docreader_ocr_page_seconds", seconds)
+        pages = trace.get("pages", 0)
+        ocr_pages = trace.get("ocr_pages", 0)
+        if pages:
+            self.inc("docreader_pages_total", pages - ocr_pages, source="text_layer")
+            self.inc("docreader_pages_total", ocr_pages, source="ocr")
+            self.observe("docreader_ocr_page_ratio", ocr_pages / pages, buckets=RATIO_BUCKETS)
+        if trace.get("pixels_in"):
+            self.inc("docreader_pixels_total", trace["pixels_in"], stage="before_preprocess")
+            self.inc("docreader_pixels_total", trace.get("pixels_out", 0), stage="after_preprocess")
+            self.inc("docreader_blank_pages_total", trace.get("blank_pages", 0))
+            self.inc("docreader_ocr_seconds_saved_total", trace.get("ocr_seconds_saved", 0.0))
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if trace.get(kind):
+                self.inc("docreader_tokens_total", trace[kind], kind=kind)
+        logging.info(f"trace {trace}")
+
+    def recent_traces(self):
+        with self.lock:
+            return list(self.traces)
+
+    def render(self):
+        """all metrics in the prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h.buckets), list(h.counts), h.count, h.sum) for key, h in self.histograms.items()}
+            gauges = dict(self.gauges)
+
+        seen = set()
+
+        def header(name, kind):
+            if (name, kind) in seen:
+                return
+            seen.add((name, kind))
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_label_text(dict(labels))} {value}")
+
+        for (name, labels), callback in sorted(gauges.items(), key=lambda item: item[0]):
+            header(name, "gauge")
+            try:
+                value = callback()
+            except Exception:
+                continue
+            lines.append(f"{name}{_label_text(dict(labels))} {value}")
+
+        for (name, labels), (buckets, counts, count, total) in sorted(histograms.items()):
+            header(name, "histogram")
+            labels = dict(labels)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_label_text({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{_label_text({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{name}_sum{_label_text(labels)} {total}")
+            lines.append(f"{name}_count{_label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+METRICS.describe("docreader_documents_total", "documents finished by the pipeline")
+METRICS.describe("docreader_stage_seconds", "time per document spent in a pipeline stage")
+METRICS.describe("docreader_ocr_page_seconds", "OCR time of a single page")
+METRICS.describe("docreader_pages_total", "pages read from the text layer or with OCR")
+METRICS.describe("docreader_ocr_page_ratio", "share of the pages of a document that needed OCR")
+METRICS.describe("docreader_pixels_total", "image pixels before and after the preprocessing for OCR")
+METRICS.describe("docreader_blank_pages_total", "blank pages skipped by the preprocessing")
+METRICS.describe("docreader_ocr_seconds_saved_total", "estimated OCR seconds saved by the preprocessing")
+METRICS.describe("docreader_tokens_total", "LLM tokens used")
+METRICS.describe("docreader_queue_depth", "items waiting in a pipeline queue")
+METRICS.describe("docreader_uptime_seconds", "seconds since the metrics were created")
+METRICS.describe("docreader_startup_seconds", "time spent per phase of the service start")
+_started = time.time()
+METRICS.gauge("docreader_uptime_seconds", lambda: round(time.time() - _started, 1))
+
+
+def create_metrics_app(registry=METRICS):
+    """small flask app with /metrics and /traces"""
+    from flask import Flask, Response, jsonify
+
+    app = Flask("docreader-metrics")
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/traces")
+    def traces():
+        return jsonify(registry.recent_traces())
+
+    return app
+
+
+def start_metrics_server(host="127.0.0.1", port=9100, registry=METRICS):
+    """serve the metrics app from a daemon thread, returns the server"""
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, create_metrics_app(registry), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logging.info(f"metrics endpoint on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,125 @@
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# answer in the format of the fine-tuned model
+DEFAULT_ANSWER = {
+    "title": "Invoice",
+    "summary": "Synthetic summary of a test document.",
+    "bank_info": {"bank_name": "Test Bank", "account_number": "DE00 0000 0000 0000 0000 00",
+                  "account_holder": "Test GmbH", "transfer_deadline": "01-01-2025",
+                  "amount": {"currency": "EUR", "value": 100.0}},
+    "related_companies_or_people": {"name": "Test Person", "company": "Test GmbH", "position": "N/A",
+                                    "contact_info": {"phone": "N/A", "email": "N/A",
+                                                     "address": {"street": "N/A", "city": "N/A",
+                                                                 "postal_code": "N/A", "country": "N/A"}}},
+    "recipients": {"name": "N/A", "email": "N/A"},
+    "reference_number": "0000",
+    "language": "German",
+    "timestamp": "01-01-2025",
+}
+
+
+class MockLLMServer:
+    """
+    Minimal OpenAI compatible chat completion server for tests and benchmarks.
+    Point SummaryService at it with base_url=server.base_url.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, fail_every=0, fail_status=429, answer=None):
+        """
+        :param port: 0 picks a free port
+        :param latency: seconds every answer is delayed
+        :param fail_every: answer every n-th request with fail_status, 0 never fails
+        :param fail_status: http status of the injected failures
+        :param answer: dict returned as message content
+        """
+        self.latency = latency
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.answer = json.dumps(answer or DEFAULT_ANSWER)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive, so connection reuse can be observed
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with mock.lock:
+                    mock.requests += 1
+                    number = mock.requests
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                if not self.path.endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": "not found"}})
+                if mock.fail_every and number % mock.fail_every == 0:
+                    return self._send(mock.fail_status, {"error": {"message": "injected failure"}},
+                                      {"Retry-After": "0"})
+
+                prompt = " ".join(str(message.get("content", "")) for message in request.get("messages", []))
+                prompt_tokens = len(prompt) // 4 + 1
+                completion_tokens = len(mock.answer) // 4 + 1
+                self._send(200, {
+                    "id": f"chatcmpl-mock-{number}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": mock.answer}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                })
+
+            def _send(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="local mock of the OpenAI chat completion api")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-every", type=int, default=0)
+    parser.add_argument("--fail-status", type=int, default=429)
+    args = parser.parse_args()
+
+    mock = MockLLMServer(port=args.port, latency=args.latency,
+                         fail_every=args.fail_every, fail_status=args.fail_status)
+    print(f"mock LLM server listening on {mock.base_url}")
+    mock.server.serve_forever()
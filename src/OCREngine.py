@@ -0,0 +1,304 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+import numpy as np
+
+# easyocr has no 'ch' model, the Chinese readers are called ch_sim / ch_tra
+LANGUAGE_ALIASES = {
+    'ch': 'ch_sim',
+    'zh-cn': 'ch_sim',
+    'zh-tw': 'ch_tra',
+}
+
+DEFAULT_MAX_MEMORY_MB = 2048
+DEFAULT_READER_SIZE_MB = 100   # used when the model size can not be measured
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_MAX_WAIT = 0.02        # seconds an image waits for pages of other documents before it is read
+SHAPE_ROUNDING = 64            # images are padded up to a multiple of this to share a batch
+
+
+class OCREnginePool:
+    """
+    Registry of easyocr readers keyed by language set.
+    Every reader is loaded once on first use and then kept warm, the least
+    recently used readers are dropped when the memory cap is exceeded.
+    """
+
+    def __init__(self, max_memory_mb=DEFAULT_MAX_MEMORY_MB, gpu=False):
+        """
+        :param max_memory_mb: upper bound for the summed model size of all loaded readers
+        :param gpu: passed on to easyocr.Reader
+        """
+        self.max_memory_mb = max_memory_mb
+        self.gpu = gpu
+        self._readers = OrderedDict()   # key -> (reader, size_mb)
+        self._lock = threading.Lock()
+        self._load_locks = {}           # key -> lock, so a model is never loaded twice in parallel
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(languages):
+        """normalize a language or a list of languages to a hashable key"""
+        if isinstance(languages, str):
+            languages = [languages]
+        return tuple(sorted({LANGUAGE_ALIASES.get(lang, lang) for lang in languages}))
+
+    def get_reader(self, languages):
+        """return the warm reader for the language set, load it if necessary"""
+        key = self.make_key(languages)
+
+        with self._lock:
+            if key in self._readers:
+                self._readers.move_to_end(key)
+                self.hits += 1
+                return self._readers[key][0]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # another thread may have loaded the model while we were waiting
+            with self._lock:
+                if key in self._readers:
+                    self._readers.move_to_end(key)
+                    self.hits += 1
+                    return self._readers[key][0]
+
+            reader = self._load_reader(key)
+            size_mb = self._estimate_size_mb(reader)
+
+            with self._lock:
+                self._readers[key] = (reader, size_mb)
+                self.loads += 1
+                self._evict(keep=key)
+                self._load_locks.pop(key, None)
+            return reader
+
+    def _load_reader(self, key):
+        import easyocr   # heavy import, only paid when OCR is really needed
+
+        logging.info(f"loading OCR reader for {list(key)}")
+        return easyocr.Reader(list(key), gpu=self.gpu)
+
+    @staticmethod
+    def _estimate_size_mb(reader):
+        """sum the parameter size of the detection and recognition models"""
+        size = 0
+        for model in (getattr(reader, 'detector', None), getattr(reader, 'recognizer', None)):
+            try:
+                size += sum(p.numel() * p.element_size() for p in model.parameters())
+            except AttributeError:
+                return DEFAULT_READER_SIZE_MB
+        return size / (1024 * 1024)
+
+    def memory_mb(self):
+        with self._lock:
+            return sum(size for _, size in self._readers.values())
+
+    def _evict(self, keep):
+        """drop least recently used readers until the memory cap holds, must be called with the lock"""
+        total = sum(size for _, size in self._readers.values())
+        for key in list(self._readers):
+            if total <= self.max_memory_mb:
+                break
+            if key == keep:
+                continue
+            _, size = self._readers.pop(key)
+            total -= size
+            self.evictions += 1
+            logging.info(f"evicted OCR reader for {list(key)} ({size:.0f} MB)")
+
+    def clear(self):
+        with self._lock:
+            self._readers.clear()
+
+
+class OCRBatcher:
+    """
+    Collects the images of the documents a process extracts at the same time
+    and reads them with easyocr's batched path. Images of a batch need the same
+    size, so they are grouped by language and by their size rounded up to
+    SHAPE_ROUNDING and padded with white. Results are handed back through
+    futures in submit order. All model passes of the process run on the batcher
+    thread, so the readers are never used by two threads at once.
+    The batcher only waits max_wait for more images while a registered producer
+    is still working on its pages, a lone photo or pdf is read right away.
+    """
+
+    def __init__(self, pool, batch_size=DEFAULT_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT, torch_threads=None):
+        """
+        :param pool: OCREnginePool the readers come from
+        :param batch_size: maximum number of images per model pass
+        :param max_wait: seconds the first image of a batch waits for more
+        :param torch_threads: size of the torch intra-op thread pool, None keeps the torch default
+        """
+        self.pool = pool
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.torch_threads = torch_threads
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.images = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._producers = 0   # documents being extracted, see producer()
+        self._blocked = 0     # of them waiting in read_many, they submit nothing until they get their texts
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ocr-batcher", daemon=True)
+                self._thread.start()
+
+    @contextmanager
+    def producer(self):
+        """register a document whose pages are submitted, the batcher waits for its pages while it works"""
+        with self._lock:
+            self._producers += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._producers -= 1
+
+    def _more_expected(self):
+        """True while a registered document may still submit pages"""
+        with self._lock:
+            return self._producers > self._blocked
+
+    def submit(self, languages, image):
+        """
+        queue a numpy image for OCR
+        :return: Future of the recognized text
+        """
+        self._ensure_started()
+        future = Future()
+        with self._lock:
+            self.requests.put((OCREnginePool.make_key(languages), image, future))
+        return future
+
+    def read_many(self, requests):
+        """
+        read several images at once and keep their order
+        :param requests: list of (languages, image)
+        :return: list of texts
+        """
+        self._ensure_started()
+        futures = [Future() for _ in requests]
+        with self._lock:
+            # queued together with the blocked count, so the batcher never waits for them after seeing it
+            for (languages, image), future in zip(requests, futures):
+                self.requests.put((OCREnginePool.make_key(languages), image, future))
+            self._blocked += 1
+        try:
+            return [future.result() for future in futures]
+        finally:
+            with self._lock:
+                self._blocked -= 1
+
+    def _run(self):
+        if self.torch_threads:
+            import torch
+            torch.set_num_threads(self.torch_threads)
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.requests.get_nowait())
+                    continue
+                except queue.Empty:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._more_expected():
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._read_batch(batch)
+
+    @staticmethod
+    def _group_key(key, image):
+        height, width = image.shape[:2]
+        round_up = lambda value: -(-value // SHAPE_ROUNDING) * SHAPE_ROUNDING
+        return key, image.ndim, round_up(height), round_up(width)
+
+    def _read_batch(self, batch):
+        groups = OrderedDict()
+        for key, image, future in batch:
+            groups.setdefault(self._group_key(key, image), []).append((image, future))
+
+        for (key, ndim, height, width), members in groups.items():
+            try:
+                reader = self.pool.get_reader(key)
+                if len(members) == 1:
+                    results = [reader.readtext(members[0][0], detail=0)]
+                else:
+                    images = [self._pad(image, height, width) for image, _ in members]
+                    results = reader.readtext_batched(images, detail=0)
+                self.batches += 1
+                self.images += len(members)
+                for (_, future), result in zip(members, results):
+                    future.set_result(" ".join(result))
+            except Exception as e:
+                for _, future in members:
+                    if not future.done():
+                        future.set_exception(e)
+
+    @staticmethod
+    def _pad(image, height, width):
+        """pad an image with white at the bottom and right to the given size"""
+        padding = [(0, height - image.shape[0]), (0, width - image.shape[1])] + [(0, 0)] * (image.ndim - 2)
+        return np.pad(image, padding, mode="constant", constant_values=255)
+
+
+_pool = None
+_pool_pid = None
+_batcher = None
+_pool_lock = threading.Lock()
+
+
+def get_ocr_pool():
+    """
+    Return the OCR pool of the current process.
+    Torch models can not be shared between processes, so every worker process
+    gets its own pool which then stays warm for the lifetime of the worker.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            max_memory_mb = float(os.environ.get("OCR_POOL_MAX_MB", DEFAULT_MAX_MEMORY_MB))
+            _pool = OCREnginePool(max_memory_mb=max_memory_mb)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def get_ocr_batcher():
+    """Return the OCR batcher of the current process, it reads with the readers of get_ocr_pool()"""
+    global _batcher
+    pool = get_ocr_pool()
+    with _pool_lock:
+        if _batcher is None or _batcher.pool is not pool:
+            torch_threads = os.environ.get("OCR_TORCH_THREADS")
+            _batcher = OCRBatcher(pool,
+                                  batch_size=int(os.environ.get("OCR_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+                                  max_wait=float(os.environ.get("OCR_MAX_WAIT", DEFAULT_MAX_WAIT)),
+                                  torch_threads=int(torch_threads) if torch_threads else None)
+        return _batcher
+
+
+def _reset_after_fork():
+    global _pool, _pool_pid, _batcher, _pool_lock
+    _pool = None
+    _pool_pid = None
+    _batcher = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,460 @@
+import os
+import json
+import time
+import queue
+import shutil
+import logging
+import threading
+import multiprocessing
+from Handlers import extract_document_traced, warm_up_ocr
+from WorkerPool import ThreadedProcessPool
+from Database.CacheHandler import ResultCache
+from DocumentSchema import SummaryValidationError, parse_summary
+from Metrics import METRICS
+
+_STOP = object()   # sentinel telling a stage worker to finish
+
+
+class PipelineItem:
+    """one document travelling through the pipeline"""
+
+    def __init__(self, file_path, job_id=None):
+        self.file_path = file_path
+        self.job_id = job_id
+        self.filename = os.path.basename(file_path)
+        self.extracted_text = None
+        self.summary = None        # validated DocumentSummary
+        self.summary_json = None   # its serialization for the cache, the job and the document row
+        self.file_hash = None
+        self.text_hash = None
+        self.usage = None
+        self.document_id = None   # set when the document was stored before a restart
+        self.target = None
+        self.started = time.perf_counter()
+        self.trace = {"file": self.filename, "stages": {}}
+
+
+class DocumentPipeline:
+    """
+    Staged document processing:
+    extraction pool (processes) -> LLM stage (threads) -> single DB writer.
+    The stages are joined by bounded queues, so a slow stage blocks the one
+    before it instead of piling up work in memory.
+    """
+
+    def __init__(self, db_manager, summarizer, handled_directory, temp_path,
+                 extract_workers=None, llm_workers=4, queue_size=16, dpi=200, grayscale=True,
+                 cache=None, db_batch_size=32, jobs=None, preprocess=True, preprocess_profiles=None,
+                 move_files=True, db_max_wait=0.0, worker_initializer=None, worker_initargs=(),
+                 documents_per_worker=2):
+        """
+        :param db_manager: connected DatabaseManager, only used from the writer thread
+        :param summarizer: callable turning extracted text into (DocumentSummary, token usage dict)
+        :param handled_directory: directory the processed files are moved to, unused without move_files
+        :param temp_path: directory for temporary files of the extractor
+        :param extract_workers: number of extraction processes, defaults to the cpu count
+        :param llm_workers: number of concurrent LLM requests
+        :param queue_size: capacity of every queue between the stages
+        :param dpi: resolution scanned pdf pages are rendered with for OCR
+        :param grayscale: render scanned pdf pages in grayscale
+        :param cache: optional connected ResultCache to skip extraction and summary of known content
+        :param db_batch_size: maximum number of documents the writer commits in one transaction
+        :param jobs: optional connected JobQueue, every stage is checkpointed there
+        :param preprocess: right-size images and skip blank pages before OCR
+        :param preprocess_profiles: preprocessing settings per source type, see Preprocess.PROFILES
+        :param move_files: move stored files to handled_directory, otherwise they stay and are linked in place
+        :param db_max_wait: seconds the writer waits for a batch to fill, for large transactions in bulk loads
+        :param worker_initializer: called in every extraction process when it starts, e.g. Handlers.warm_up_ocr
+        :param worker_initargs: arguments of worker_initializer
+        :param documents_per_worker: documents every extraction process works on at the same time,
+                                     their scanned pages share the OCR batches of the process
+        """
+        self.db_manager = db_manager
+        self.summarizer = summarizer
+        self.handled_directory = handled_directory
+        self.temp = temp_path
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.llm_workers = llm_workers
+        self.dpi = dpi
+        self.grayscale = grayscale
+        self.cache = cache
+        self.db_batch_size = db_batch_size
+        self.jobs = jobs
+        self.preprocess = preprocess
+        self.preprocess_profiles = preprocess_profiles
+        self.move_files = move_files
+        self.db_max_wait = db_max_wait
+        self.worker_initializer = worker_initializer
+        self.worker_initargs = worker_initargs
+        self.documents_per_worker = max(1, documents_per_worker)
+
+        self.extract_queue = queue.Queue(maxsize=queue_size)
+        self.llm_queue = queue.Queue(maxsize=queue_size)
+        # room for a full batch, otherwise the queue bound would cap the transaction size
+        self.db_queue = queue.Queue(maxsize=max(queue_size, db_batch_size))
+
+        self.executor = None
+        self._threads = {}
+        self._in_flight = {}   # file path -> job id, None until the job is leased
+        self._in_flight_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.finished = {}   # status -> number of documents
+
+    def start(self):
+        if self.cache:
+            self.cache.evict()
+        # spawn instead of fork: the workers load torch, which is not fork safe
+        self.executor = ThreadedProcessPool(self.extract_workers, threads=self.documents_per_worker,
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=self.worker_initializer, initargs=self.worker_initargs)
+        for name, stage_queue in (("extract", self.extract_queue), ("llm", self.llm_queue), ("db", self.db_queue)):
+            METRICS.gauge("docreader_queue_depth", stage_queue.qsize, queue=name)
+        # one thread per document the extraction processes work on at a time
+        extract_threads = self.extract_workers * self.documents_per_worker
+        self._threads = {
+            "extract": [self._start_thread(self._extract_worker, f"extract-{i}") for i in range(extract_threads)],
+            "llm": [self._start_thread(self._llm_worker, f"llm-{i}") for i in range(self.llm_workers)],
+            "db": [self._start_thread(self._db_writer, "db-writer")],
+        }
+        if self.jobs:
+            self._start_thread(self._renew_leases, "job-heartbeat")
+        logging.info(f"pipeline started with {self.extract_workers} extraction workers for "
+                     f"{self.documents_per_worker} documents each and {self.llm_workers} LLM workers")
+
+    def warm_up(self, languages):
+        """
+        Load the OCR readers in the extraction workers from a background thread,
+        so the watcher is live right away and the first scan finds warm models.
+        One task per worker is queued, the pool gives every task to the
+        worker with the fewest tasks, so they spread over the workers.
+        """
+        def run():
+            futures = [self.executor.submit(warm_up_ocr, languages) for _ in range(self.extract_workers)]
+            for future in futures:
+                try:
+                    pid, seconds = future.result()
+                    logging.info(f"OCR warm-up of {languages} in worker {pid} took {seconds:.1f}s")
+                except Exception as e:
+                    logging.error("OCR warm-up error: %s", e)
+
+        return self._start_thread(run, "ocr-warm-up")
+
+    @staticmethod
+    def _start_thread(target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def submit(self, file_path, retry_failed=False):
+        """
+        queue a file for processing, blocks while the extraction stage is full
+        :param retry_failed: process a file again whose job failed before
+        """
+        with self._in_flight_lock:
+            if file_path in self._in_flight:
+                return False
+            self._in_flight[file_path] = None
+
+        if not self.jobs:
+            self.extract_queue.put(PipelineItem(file_path))
+            return True
+        job_id = self.jobs.enqueue(file_path, retry_failed=retry_failed)
+        leased = self.jobs.lease(job_id=job_id)
+        if not leased:
+            # another worker holds the job, it is finished or it failed before
+            with self._in_flight_lock:
+                self._in_flight.pop(file_path, None)
+            return False
+        with self._in_flight_lock:
+            self._in_flight[file_path] = job_id
+        # a job left unfinished by an earlier run continues after its last checkpoint
+        self._route(leased[0])
+        return True
+
+    def finished_counts(self):
+        """copy of the number of finished documents per status"""
+        with self._in_flight_lock:
+            return dict(self.finished)
+
+    def in_flight(self):
+        """number of submitted documents which are not finished yet"""
+        with self._in_flight_lock:
+            return len(self._in_flight)
+
+    def resume(self, limit=1000):
+        """
+        Lease unfinished jobs, e.g. after a crash, and continue each one after
+        its last checkpoint instead of starting over.
+        :return: number of resumed jobs
+        """
+        if not self.jobs:
+            return 0
+        resumed = 0
+        for job in self.jobs.lease(limit=limit):
+            with self._in_flight_lock:
+                if job["file_path"] in self._in_flight:
+                    continue
+                self._in_flight[job["file_path"]] = job["id"]
+            self._route(job)
+            resumed += 1
+        if resumed:
+            logging.info(f"resumed {resumed} unfinished jobs")
+        return resumed
+
+    def _renew_leases(self):
+        """
+        Heartbeat of the jobs in flight. A large scan can take longer than the
+        lease before its first checkpoint, and a job waiting in a full queue as
+        well, without renewal resume would take them over and count attempts.
+        """
+        interval = self.jobs.lease_seconds / 3
+        while not self._stopped.wait(interval):
+            with self._in_flight_lock:
+                job_ids = [job_id for job_id in self._in_flight.values() if job_id is not None]
+            try:
+                self.jobs.renew(job_ids)
+            except Exception as e:
+                logging.error("lease renewal error: %s", e)
+
+    def _route(self, job):
+        """queue a leased job at the stage after its last checkpoint"""
+        item = PipelineItem(job["file_path"], job["id"])
+        item.file_hash = job["file_hash"]
+        item.extracted_text = job["extracted_text"]
+        item.usage = json.loads(job["usage_json"]) if job["usage_json"] else None
+        item.document_id = job["document_id"]
+        item.target = job["link_target"]
+        if job["state"] != "queued":
+            item.trace["resumed_from"] = job["state"]
+
+        if job["state"] == "queued" or not item.extracted_text:
+            self.extract_queue.put(item)
+        elif job["state"] == "extracted" or not self._restore_summary(item, job["json_str"]):
+            self.llm_queue.put(item)
+        else:
+            self.db_queue.put(item)
+
+    @staticmethod
+    def _restore_summary(item, json_str):
+        """validate a summary stored by the cache or a checkpoint, False if it has to be made again"""
+        if json_str is None:
+            return False
+        try:
+            item.summary = parse_summary(json_str)
+        except SummaryValidationError as e:
+            logging.warning(f"stored summary of {item.filename} is invalid: {e}")
+            return False
+        item.summary_json = json_str
+        return True
+
+    def _checkpoint(self, item, state, **fields):
+        if self.jobs and item.job_id is not None:
+            self.jobs.checkpoint(item.job_id, state, **fields)
+
+    def _done(self, item, status, error=None):
+        with self._in_flight_lock:
+            self._in_flight.pop(item.file_path, None)
+            self.finished[status] = self.finished.get(status, 0) + 1
+        if self.jobs and item.job_id is not None:
+            try:
+                if status == "stored":
+                    self.jobs.finish(item.job_id)
+                else:
+                    # an empty document or a broken summary will not change by retrying
+                    self.jobs.fail(item.job_id, error or status, final=status in ("empty", "invalid_summary"))
+            except Exception as e:
+                logging.error("job update error for %s: %s", item.filename, e)
+        item.trace["status"] = status
+        item.trace["total_seconds"] = time.perf_counter() - item.started
+        METRICS.record_trace(item.trace)
+
+    def _extract_worker(self):
+        while True:
+            item = self.extract_queue.get()
+            if item is _STOP:
+                break
+            if self._from_file_cache(item):
+                self._checkpoint(item, "summarized", file_hash=item.file_hash,
+                                 extracted_text=item.extracted_text, json_str=item.summary_json)
+                self.db_queue.put(item)
+                continue
+            start = time.perf_counter()
+            try:
+                item.extracted_text, timings = self.executor.submit(extract_document_traced, item.file_path, self.temp,
+                                                                    self.dpi, self.grayscale, self.preprocess,
+                                                                    self.preprocess_profiles).result()
+            except Exception as e:
+                logging.error("extraction error for %s: %s", item.filename, e)
+                self._done(item, "extract_error", e)
+                continue
+            self._trace_extraction(item, time.perf_counter() - start, timings)
+
+            if not item.extracted_text:
+                logging.info(f"nothing in extracted_text of {item.filename}")
+                self._done(item, "empty")
+                continue
+            logging.info(f"text has been extracted from {item.filename}")
+            self._checkpoint(item, "extracted", file_hash=item.file_hash, extracted_text=item.extracted_text)
+            if self._from_text_cache(item):
+                self._checkpoint(item, "summarized", json_str=item.summary_json)
+                self.db_queue.put(item)
+            else:
+                self.llm_queue.put(item)
+
+    @staticmethod
+    def _trace_extraction(item, seconds, timings):
+        stages = item.trace["stages"]
+        stages["extract"] = seconds
+        stages["text_layer"] = timings.get("text_layer_seconds", 0.0)
+        stages["language_detection"] = timings.get("language_seconds", 0.0)
+        stages["preprocess"] = timings.get("preprocess_seconds", 0.0)
+        stages["ocr"] = timings.get("ocr_seconds", 0.0)
+        for key in ("pixels_in", "pixels_out", "blank_pages", "ocr_seconds_saved"):
+            item.trace[key] = timings.get(key, 0)
+        item.trace["pages"] = timings.get("pages", 0)
+        item.trace["ocr_pages"] = timings.get("ocr_pages", 0)
+        item.trace["ocr_page_seconds"] = timings.get("ocr_page_seconds", [])
+
+    def _from_file_cache(self, item):
+        """fill text and summary from an identical file processed before"""
+        if not self.cache:
+            return False
+        try:
+            item.file_hash = ResultCache.file_hash(item.file_path)
+        except OSError as e:
+            logging.error("hash error for %s: %s", item.filename, e)
+            return False
+        cached = self.cache.lookup_file(item.file_hash)
+        if cached is None or not self._restore_summary(item, cached[1]):
+            return False
+        item.extracted_text = cached[0]
+        item.trace["cache"] = "file"
+        logging.info(f"cache hit for {item.filename}, skipping extraction and summary")
+        return True
+
+    def _from_text_cache(self, item):
+        """fill the summary from a document with the same normalized text"""
+        if not self.cache or item.file_hash is None:
+            return False
+        item.text_hash = ResultCache.text_hash(item.extracted_text)
+        if not self._restore_summary(item, self.cache.lookup_text(item.text_hash)):
+            return False
+        item.trace["cache"] = "text"
+        logging.info(f"text cache hit for {item.filename}, skipping summary")
+        # under its own hash as well, so the next copy of this file skips the extraction too
+        self.cache.store(item.file_hash, item.text_hash, item.extracted_text, item.summary_json)
+        return True
+
+    def _llm_worker(self):
+        while True:
+            item = self.llm_queue.get()
+            if item is _STOP:
+                break
+            start = time.perf_counter()
+            try:
+                item.summary, item.usage = self.summarizer(item.extracted_text)
+                item.summary_json = item.summary.model_dump_json()
+            except Exception as e:
+                logging.error("summary error for %s: %s", item.filename, e)
+                self._done(item, "summary_error", e)
+                continue
+            item.trace["stages"]["llm"] = time.perf_counter() - start
+            item.trace["prompt_tokens"] = item.usage.get("prompt_tokens", 0)
+            item.trace["completion_tokens"] = item.usage.get("completion_tokens", 0)
+            logging.info(f"get json format summary of {item.filename}: {item.usage}")
+
+            if self.cache and item.file_hash is not None:
+                self.cache.store(item.file_hash, item.text_hash, item.extracted_text, item.summary_json)
+            self._checkpoint(item, "summarized", json_str=item.summary_json, usage=item.usage)
+            self.db_queue.put(item)
+
+    def _db_writer(self):
+        """take whatever is waiting in the queue and write it with one transaction"""
+        stop = False
+        while not stop:
+            batch = [self.db_queue.get()]
+            deadline = time.monotonic() + self.db_max_wait
+            while len(batch) < self.db_batch_size and batch[-1] is not _STOP:
+                try:
+                    remaining = deadline - time.monotonic()
+                    batch.append(self.db_queue.get(timeout=remaining) if remaining > 0 else self.db_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stop = True
+                batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self._store(batch)
+
+    def _store(self, batch):
+        for item in batch:
+            if not self.move_files:
+                item.target = item.file_path
+                continue
+            if item.target is None:
+                extension = os.path.splitext(item.filename)[1][1:].upper()  # Get extension and remove the dot
+                item.target = os.path.join(self.handled_directory, extension, item.filename)
+            os.makedirs(os.path.dirname(item.target), exist_ok=True)
+
+        # documents stored before a restart only miss the move
+        to_insert = [item for item in batch if item.document_id is None]
+        start = time.perf_counter()
+        try:
+            # the documents and their job checkpoints are committed together
+            with self.db_manager.transaction():
+                # the validated summaries are written as they are, without another json round trip
+                document_ids = self.db_manager.insert_batch([(item.summary, item.target, item.extracted_text,
+                                                              item.usage, item.summary_json) for item in to_insert])
+                for item, document_id in zip(to_insert, document_ids):
+                    item.document_id = document_id
+                    if document_id is not None and self.jobs and item.job_id is not None:
+                        self.jobs.checkpoint(item.job_id, "stored", connection=self.db_manager.connection,
+                                             document_id=document_id, link_target=item.target)
+        except Exception as e:
+            # nothing was written, the jobs are retried from their summary
+            logging.error("insert_batch error: %s", e)
+            for item in to_insert:
+                self._done(item, "insert_error", e)
+            batch = [item for item in batch if item not in to_insert]
+        # one transaction for the batch, every document carries its share
+        insert_seconds = (time.perf_counter() - start) / max(len(batch), 1)
+
+        for item in batch:
+            item.trace["stages"]["db_insert"] = insert_seconds
+            if item.document_id is None:
+                # the summary could not be stored, the file stays where it is
+                logging.error(f"no document stored for {item.filename}")
+                self._done(item, "invalid_summary")
+                continue
+            if not self.move_files:
+                self._done(item, "stored")
+                continue
+            if not os.path.exists(item.file_path) and os.path.exists(item.target):
+                # moved before a restart, only the job was not finished
+                logging.info(f"{item.filename} was moved already")
+                self._done(item, "stored")
+                continue
+            start = time.perf_counter()
+            try:
+                shutil.move(item.file_path, item.target)
+                logging.info(f"Moved file: {item.filename} to {os.path.dirname(item.target)}")
+            except Exception as e:
+                logging.error("store error for %s: %s", item.filename, e)
+                self._done(item, "move_error", e)
+                continue
+            item.trace["stages"]["move"] = time.perf_counter() - start
+            self._done(item, "stored")
+
+    def shutdown(self):
+        """stop accepting work and drain every stage in order"""
+        for stage, next_queue in (("extract", self.extract_queue), ("llm", self.llm_queue), ("db", self.db_queue)):
+            for _ in self._threads.get(stage, []):
+                next_queue.put(_STOP)
+            for thread in self._threads.get(stage, []):
+                thread.join()
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        self._stopped.set()
+        if self.cache:
+            logging.info(f"result cache stats: {self.cache.stats()}")
+        logging.info("pipeline drained")
@@ -0,0 +1,221 @@
+import time
+import cv2
+import numpy as np
+
+# settings per source type, scans are rendered pdf pages and flatbed scans, photos come from phone cameras
+PROFILES = {
+    "scan": {
+        "target_text_height": 28,   # median character height in pixel the image is scaled to
+        "min_scale": 0.25,
+        "max_scale": 2.0,
+        "max_side": 3500,           # longest side after scaling
+        "deskew": True,
+        "max_skew": 10.0,           # degrees, larger angles are rather rotated pages than skew
+        "crop_margins": True,
+        "margin": 16,               # pixel kept around the text after cropping
+        "blank_ink_ratio": 0.001,   # pages with less ink are treated as blank
+    },
+    "photo": {
+        "target_text_height": 32,
+        "min_scale": 0.2,
+        "max_scale": 1.5,
+        "max_side": 2560,
+        "deskew": True,
+        "max_skew": 15.0,
+        "crop_margins": False,      # the table or background around the paper would count as ink
+        "margin": 16,
+        "blank_ink_ratio": 0.002,
+    },
+}
+
+# source type of the files, rendered pdf pages are always scans
+SOURCE_TYPES = {
+    ".pdf": "scan",
+    ".png": "scan",
+    ".jpg": "photo",
+    ".jpeg": "photo",
+}
+
+ANALYSIS_MAX_SIDE = 1000   # the measurements are done on a copy of this size
+INK_CONTRAST = 40          # gray levels darker than the background that count as ink
+MIN_COMPONENTS = 10        # fewer characters are no reliable base for the text height
+LINE_JOIN_FRACTION = 50    # gaps up to this fraction of the page width are closed to join the words of a line
+MIN_LINE_WIDTH = 0.1       # fraction of the page width a blob needs to count as text line
+MIN_LINE_ASPECT = 5        # length to height ratio of a text line
+MIN_LINES = 3              # fewer lines are no reliable base for the skew
+
+
+def source_type(file_path):
+    """source type of a file by its extension, unknown ones are treated as scans"""
+    for extension, kind in SOURCE_TYPES.items():
+        if file_path.lower().endswith(extension):
+            return kind
+    return "scan"
+
+
+class ImagePreprocessor:
+    """
+    Right-sizes images before OCR: converts to grayscale, detects blank pages,
+    deskews, crops the margins and scales the image so the text has the target height.
+    OCR time grows with the pixel count, so oversized photos get cheaper and
+    tiny text gets readable. Counts the pixels before and after in stats.
+    """
+
+    def __init__(self, profiles=None):
+        """
+        :param profiles: dict source type -> settings, merged over PROFILES
+        """
+        self.profiles = {kind: dict(settings) for kind, settings in PROFILES.items()}
+        for kind, settings in (profiles or {}).items():
+            self.profiles.setdefault(kind, dict(PROFILES["scan"])).update(settings)
+        self.stats = {"images": 0, "blank_pages": 0, "blank_pixels": 0, "pixels_in": 0, "pixels_out": 0,
+                      "preprocess_seconds": 0.0}
+
+    def process(self, image, kind="scan"):
+        """
+        :param image: numpy image, gray or color
+        :param kind: source type, key of the profiles
+        :return: the preprocessed grayscale image, None if the page is blank
+        """
+        settings = self.profiles.get(kind, self.profiles["scan"])
+        start = time.perf_counter()
+        self.stats["images"] += 1
+        self.stats["pixels_in"] += image.shape[0] * image.shape[1]
+
+        gray = self._grayscale(image)
+        ink, factor = self._ink_mask(gray)
+        if np.count_nonzero(ink) < settings["blank_ink_ratio"] * ink.size:
+            self.stats["blank_pages"] += 1
+            self.stats["blank_pixels"] += image.shape[0] * image.shape[1]
+            self.stats["preprocess_seconds"] += time.perf_counter() - start
+            return None
+
+        if settings["deskew"]:
+            angle = self._skew_angle(ink)
+            if 0.3 < abs(angle) <= settings["max_skew"]:
+                gray = self._rotate(gray, angle)
+                ink, factor = self._ink_mask(gray)
+
+        if settings["crop_margins"]:
+            gray, ink = self._crop(gray, ink, factor, settings["margin"])
+
+        gray = self._scale(gray, ink, factor, settings)
+
+        self.stats["pixels_out"] += gray.shape[0] * gray.shape[1]
+        self.stats["preprocess_seconds"] += time.perf_counter() - start
+        return gray
+
+    @staticmethod
+    def _grayscale(image):
+        if image.ndim == 2:
+            return image
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    @staticmethod
+    def _ink_mask(gray):
+        """
+        mask of the pixels clearly darker than the background on a small copy
+        :return: (mask, factor from full size to the copy)
+        """
+        factor = min(1.0, ANALYSIS_MAX_SIDE / max(gray.shape[:2]))
+        small = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1 else gray
+        background = int(np.median(small))
+        ink = (small < background - INK_CONTRAST).astype(np.uint8)
+        # drop single pixel specks of scanner noise
+        ink = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+        return ink, factor
+
+    @staticmethod
+    def _skew_angle(ink):
+        """
+        angle of the text lines in degrees, the median over the lines of the page.
+        The characters are joined to line blobs with a wide horizontal closing and
+        only long and flat blobs are measured, so logos, stamps and ragged margins
+        do not tilt the estimate. 0 if there are too few lines.
+        """
+        width = ink.shape[1]
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, width // LINE_JOIN_FRACTION), 1))
+        lines = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, kernel)
+        count, labels, components, _ = cv2.connectedComponentsWithStats(lines, connectivity=8)
+        angles = []
+        for label in range(1, count):
+            x, y, w, h = components[label, :4]
+            if w < width * MIN_LINE_WIDTH:
+                continue
+            points = cv2.findNonZero((labels[y:y + h, x:x + w] == label).astype(np.uint8))
+            _, (rect_width, rect_height), angle = cv2.minAreaRect(points)
+            if rect_width < rect_height:
+                # the angle belongs to the short side, turn it to the long side of the line
+                rect_width, rect_height = rect_height, rect_width
+                angle -= 90
+            if rect_width < MIN_LINE_ASPECT * max(rect_height, 1):
+                continue
+            # opencv reports the angle in (-90, 90], map it to [-45, 45)
+            if angle >= 45:
+                angle -= 90
+            elif angle < -45:
+                angle += 90
+            angles.append(angle)
+        if len(angles) < MIN_LINES:
+            return 0.0
+        return float(np.median(angles))
+
+    @staticmethod
+    def _rotate(gray, angle):
+        height, width = gray.shape[:2]
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        return cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+    @staticmethod
+    def _crop(gray, ink, factor, margin):
+        """cut the image to the bounding box of the ink plus a margin"""
+        x, y, width, height = cv2.boundingRect(ink)
+        top = max(0, int(y / factor) - margin)
+        left = max(0, int(x / factor) - margin)
+        bottom = min(gray.shape[0], int((y + height) / factor) + margin)
+        right = min(gray.shape[1], int((x + width) / factor) + margin)
+        cropped_ink = ink[y:y + height, x:x + width]
+        return gray[top:bottom, left:right], cropped_ink
+
+    @staticmethod
+    def text_height(ink, factor):
+        """median height of the characters in full size pixel, None if there are too few"""
+        _, _, components, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+        heights = components[1:, cv2.CC_STAT_HEIGHT]
+        # lines, frames and images are no characters
+        heights = heights[(heights >= 2) & (heights < ink.shape[0] / 10)]
+        if len(heights) < MIN_COMPONENTS:
+            return None
+        return float(np.median(heights)) / factor
+
+    def _scale(self, gray, ink, factor, settings):
+        scale = 1.0
+        height = self.text_height(ink, factor)
+        if height:
+            scale = min(max(settings["target_text_height"] / height, settings["min_scale"]), settings["max_scale"])
+        scale = min(scale, settings["max_side"] / max(gray.shape[:2]))
+        if abs(scale - 1.0) < 0.05:
+            return gray
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+        return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation)
+
+
+def estimate_saved_seconds(timings):
+    """
+    OCR time saved by the preprocessing, estimated from the measured OCR time
+    per pixel and the blank pages that were not read at all.
+    :param timings: extractor timings with ocr_seconds, ocr_pages, pixels_in, pixels_out, blank_pages
+    """
+    ocr_seconds = timings.get("ocr_seconds", 0.0)
+    pixels_out = timings.get("pixels_out", 0)
+    if not ocr_seconds or not pixels_out:
+        return 0.0
+    per_pixel = ocr_seconds / pixels_out
+    per_page = ocr_seconds / max(timings.get("ocr_pages", 0), 1)
+    read_pixels_in = timings.get("pixels_in", 0) - timings.get("blank_pixels", 0)
+    return (read_pixels_in - pixels_out) * per_pixel + timings.get("blank_pages", 0) * per_page - \
+        timings.get("preprocess_seconds", 0.0)
+
@@ -0,0 +1,336 @@
+import os
+import json
+import base64
+import queue
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# one row per document, the sub tables are nested as json arrays by correlated
+# subqueries so a page or a detail is a single statement instead of N+1 lookups
+DOCUMENT_SELECT = """
+SELECT d.id, d.title, d.summary, d.reference_number, d.language, d.timestamp, d.link_original,
+    (SELECT json_group_array(json_object(
+            'bank_name', b.bank_name, 'account_number', b.account_number,
+            'account_holder', b.account_holder, 'transfer_deadline', b.transfer_deadline,
+            'amount', (SELECT json_group_array(json_object('currency', a.currency, 'value', a.value))
+                       FROM amount a WHERE a.bank_info_id = b.id)))
+     FROM bank_info b WHERE b.document_id = d.id) AS bank_info,
+    (SELECT json_group_array(json_object(
+            'name', r.name, 'company', r.company, 'position', r.position, 'phone', r.phone, 'email', r.email,
+            'address', (SELECT json_group_array(json_object('street', ad.street, 'city', ad.city,
+                                                            'postal_code', ad.postal_code, 'country', ad.country))
+                        FROM address ad WHERE ad.related_info_id = r.id)))
+     FROM related_info r WHERE r.document_id = d.id) AS related_info,
+    (SELECT json_group_array(json_object('name', rc.name, 'email', rc.email))
+     FROM recipients rc WHERE rc.document_id = d.id) AS recipients
+"""
+
+NESTED_COLUMNS = ("bank_info", "related_info", "recipients")
+
+
+def encode_cursor(values):
+    """opaque pagination cursor from the sort key of the last row"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, types):
+    """
+    :param types: expected type of every value of the sort key, e.g. (int,)
+    :raises ValueError: for a cursor which was not made by encode_cursor for this sort key
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"invalid cursor {cursor!r}") from e
+    if not isinstance(values, list) or len(values) != len(types) or \
+            any(isinstance(value, bool) or not isinstance(value, kind) for value, kind in zip(values, types)):
+        raise ValueError(f"invalid cursor {cursor!r}")
+    return values
+
+
+class ReadOnlyConnections:
+    """
+    Bounded pool of read-only connections to Documents.db. The threaded server
+    starts a thread per request, so a request borrows a connection and gives it
+    back when it is done, at most size connections are ever open. WAL mode lets
+    them read while the pipeline writes.
+    """
+
+    def __init__(self, db_path, size=8):
+        """
+        :param db_path: Path to the directory of the database file
+        :param size: most connections open at the same time, a request waits for a free one
+        """
+        self.db_path = os.path.join(db_path, "Documents.db")
+        self.size = size
+        self.idle = queue.Queue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def _open(self):
+        connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA query_only = ON;")
+        return connection
+
+    @contextmanager
+    def get(self):
+        """borrow a connection for the duration of the with block"""
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                new = self.opened < self.size
+                if new:
+                    self.opened += 1
+            if new:
+                try:
+                    connection = self._open()
+                except Exception:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+            else:
+                connection = self.idle.get()
+        try:
+            yield connection
+        finally:
+            self.idle.put(connection)
+
+    def close(self):
+        """close the idle connections, call it after the server stopped"""
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self.lock:
+                self.opened -= 1
+
+
+class QueryCache:
+    """
+    LRU cache of query results. Every entry remembers the highest document id
+    at the time it was computed, a newer insert makes all entries stale.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # key -> (version, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, value):
+        with self.lock:
+            if self.entries and next(reversed(self.entries.values()))[0] != version:
+                # a new document arrived, nothing cached before it is valid anymore
+                self.entries.clear()
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class DocumentQueries:
+    """
+    Read side of the document database: pages of documents with their nested
+    sub tables, full text search and the archived originals.
+    """
+
+    def __init__(self, db_path, handled_directory, cache_size=512, connections=8):
+        """
+        :param db_path: Path to the directory of the database file
+        :param handled_directory: directory the pipeline archives the originals in
+        :param cache_size: number of cached query results
+        :param connections: size of the pool of read-only connections
+        """
+        self.connections = ReadOnlyConnections(db_path, size=connections)
+        self.handled_directory = os.path.realpath(handled_directory)
+        self.cache = QueryCache(cache_size)
+
+    def close(self):
+        self.connections.close()
+
+    def _version(self, connection):
+        """documents are only ever inserted, so the highest id tells if anything changed"""
+        return connection.execute("SELECT COALESCE(MAX(id), 0) FROM documents;").fetchone()[0]
+
+    def _cached(self, key, compute):
+        with self.connections.get() as connection:
+            version = self._version(connection)
+            value = self.cache.get(key, version)
+            if value is None:
+                value = compute(connection)
+                self.cache.put(key, version, value)
+        return value
+
+    @staticmethod
+    def _document(row, detail=False):
+        document = {key: row[key] for key in row.keys() if key not in NESTED_COLUMNS and key != "rank"}
+        for key in NESTED_COLUMNS:
+            document[key] = json.loads(row[key])
+        document["original_available"] = bool(row["link_original"])
+        if not detail:
+            document.pop("extracted_text", None)
+        return document
+
+    @staticmethod
+    def _limit(limit):
+        return min(max(1, int(limit or DEFAULT_LIMIT)), MAX_LIMIT)
+
+    def list_documents(self, after=None, limit=DEFAULT_LIMIT):
+        """
+        Newest documents first.
+        :param after: cursor of the previous page
+        :return: {"items": [...], "next": cursor or None}
+        """
+        limit = self._limit(limit)
+
+        def compute(connection):
+            where_sql, params = "", []
+            if after:
+                where_sql, params = "WHERE d.id < ?", decode_cursor(after, (int,))
+            rows = connection.execute(f"{DOCUMENT_SELECT} FROM documents d {where_sql} ORDER BY d.id DESC LIMIT ?;",
+                                      params + [limit + 1]).fetchall()
+            items = [self._document(row) for row in rows[:limit]]
+            next_cursor = encode_cursor([items[-1]["id"]]) if len(rows) > limit else None
+            return {"items": items, "next": next_cursor}
+
+        return self._cached(("list", after, limit), compute)
+
+    def get_document(self, document_id):
+        """one document with extracted text and all sub tables, None if it does not exist"""
+        def compute(connection):
+            row = connection.execute(f"{DOCUMENT_SELECT}, d.extracted_text FROM documents d WHERE d.id = ?;",
+                                     (int(document_id),)).fetchone()
+            return self._document(row, detail=True) if row is not None else {}
+
+        return self._cached(("document", int(document_id)), compute) or None
+
+    def search(self, term, after=None, limit=DEFAULT_LIMIT):
+        """
+        Full text search, best matches first, every word of the term has to occur.
+        :param after: cursor of the previous page, holds rank and id of its last row
+        :return: {"items": [...], "next": cursor or None}
+        """
+        limit = self._limit(limit)
+        words = term.split()
+        if not words:
+            return {"items": [], "next": None}
+        match = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+        def compute(connection):
+            where_sql, params = "WHERE documents_fts MATCH ?", [match]
+            if after:
+                rank, last_id = decode_cursor(after, ((int, float), int))
+                where_sql += " AND (f.rank > ? OR (f.rank = ? AND d.id > ?))"
+                params += [rank, rank, last_id]
+            rows = connection.execute(
+                f"{DOCUMENT_SELECT}, f.rank AS rank FROM documents d JOIN documents_fts f ON f.rowid = d.id "
+                f"{where_sql} ORDER BY f.rank, d.id LIMIT ?;", params + [limit + 1]).fetchall()
+            items = [self._document(row) for row in rows[:limit]]
+            next_cursor = encode_cursor([rows[limit - 1]["rank"], rows[limit - 1]["id"]]) if len(rows) > limit else None
+            return {"items": items, "next": next_cursor}
+
+        return self._cached(("search", match, after, limit), compute)
+
+    def original_path(self, document_id):
+        """path of the archived original, None if it is missing or outside the handled directory"""
+        with self.connections.get() as connection:
+            row = connection.execute("SELECT link_original FROM documents WHERE id = ?;",
+                                     (int(document_id),)).fetchone()
+        if row is None or not row["link_original"]:
+            return None
+        path = os.path.realpath(row["link_original"])
+        if os.path.commonpath([path, self.handled_directory]) != self.handled_directory or not os.path.isfile(path):
+            return None
+        return path
+
+
+def create_query_app(queries):
+    """flask app serving DocumentQueries read-only as json"""
+    from flask import Flask, jsonify, request, send_file, url_for, abort
+
+    app = Flask("docreader-query")
+
+    def with_links(document):
+        if document.get("original_available"):
+            document["original_url"] = url_for("original", document_id=document["id"])
+        document["url"] = url_for("document", document_id=document["id"])
+        return document
+
+    def page(result):
+        return jsonify({"items": [with_links(dict(item)) for item in result["items"]], "next": result["next"]})
+
+    @app.errorhandler(ValueError)
+    def bad_request(error):
+        return jsonify({"error": str(error)}), 400
+
+    @app.route("/documents")
+    def documents():
+        return page(queries.list_documents(after=request.args.get("after"), limit=request.args.get("limit")))
+
+    @app.route("/documents/<int:document_id>")
+    def document(document_id):
+        result = queries.get_document(document_id)
+        if result is None:
+            abort(404)
+        return jsonify(with_links(dict(result)))
+
+    @app.route("/documents/<int:document_id>/original")
+    def original(document_id):
+        path = queries.original_path(document_id)
+        if path is None:
+            abort(404)
+        return send_file(path)
+
+    @app.route("/search")
+    def search():
+        return page(queries.search(request.args.get("q", ""), after=request.args.get("after"),
+                                   limit=request.args.get("limit")))
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="read-only HTTP API over the document database")
+    parser.add_argument("--db-path", default=os.environ.get("DB_PATH"), help="directory of Documents.db")
+    parser.add_argument("--handled-directory", default=os.environ.get("HANDLED_DIRECTORY"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache-size", type=int, default=512, help="number of cached query results")
+    parser.add_argument("--connections", type=int, default=8, help="most read-only database connections open at once")
+    args = parser.parse_args(argv)
+    if not args.db_path or not args.handled_directory:
+        parser.error("--db-path and --handled-directory are required")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    queries = DocumentQueries(args.db_path, args.handled_directory, cache_size=args.cache_size,
+                              connections=args.connections)
+    try:
+        create_query_app(queries).run(host=args.host, port=args.port, threaded=True)
+    finally:
+        queries.close()
+
+
+if __name__ == '__main__':
+    main()
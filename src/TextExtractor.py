@@ -1,70 +1,229 @@
-import PyPDF2
-import easyocr
+import time
+import logging
+import threading
+from collections import OrderedDict
+import cv2
 import fitz  
-import tempfile
 import langdetect
+import numpy as np
+from OCREngine import get_ocr_batcher
+from Database.CacheHandler import ResultCache
+from Preprocess import ImagePreprocessor, source_type, estimate_saved_seconds
+from Handlers import PAGE_SEPARATOR
+
+DEFAULT_LANGUAGE = 'de'
+PROBE_LANGUAGES = ['ch_sim', 'en']   # probe reader, reads latin and chinese script
+PROBE_MAX_SIDE = 800                 # longest side of the low resolution probe image
+LANGUAGE_MEMO_SIZE = 4096
+
+langdetect.DetectorFactory.seed = 0   # make langdetect deterministic
+
+# MuPDF is not thread safe, the documents extracted at the same time in a process take turns
+_fitz_lock = threading.Lock()
+
+# file hash -> {page index: language}, per process
+_language_memo = OrderedDict()
+_language_memo_lock = threading.Lock()
+
+
+def to_ocr_language(text):
+    """
+    detect the language of a text and map it to an easyocr language
+    :return: the language, None if the text is too short or unsupported
+    """
+    try:
+        detected_lang = langdetect.detect(text)
+    except langdetect.LangDetectException:
+        return None
+    if detected_lang == 'zh-cn':
+        return 'ch_sim'
+    elif detected_lang == 'zh-tw':
+        return 'ch_tra'
+    elif detected_lang in ['en', 'de']:
+        return detected_lang
+    return None
+
 
 class TextExtractor:
     
-    def __init__(self, file_path, temp_file_path):
+    def __init__(self, file_path, temp_file_path, dpi=200, grayscale=True, preprocess=True, profiles=None):
+        """
+        :param file_path: file to extract
+        :param temp_file_path: directory for temporary files
+        :param dpi: resolution scanned pdf pages are rendered with for OCR
+        :param grayscale: render scanned pages in grayscale, easyocr converts to gray anyway
+        :param preprocess: right-size, deskew and crop images and skip blank pages before OCR
+        :param profiles: preprocessing settings per source type, merged over Preprocess.PROFILES
+        """
         self.file_path = file_path
         self.temp = temp_file_path
-        self.language = self.detect_language()
-        self.OCR_reader = easyocr.Reader([self.language])
+        self.dpi = dpi
+        self.grayscale = grayscale
+        self.language = None   # language of the previous page, fallback when the probe of a page finds too little text
+        self.page_languages = {}
+        self.timings = {"pages": 0, "text_layer_seconds": 0.0, "language_seconds": 0.0, "probe_pages": 0,
+                        "ocr_seconds": 0.0, "ocr_pages": 0, "ocr_page_seconds": []}
+        self._file_hash = None
+        self.preprocessor = ImagePreprocessor(profiles) if preprocess else None
         
-    def detect_language(self):
-        """detect document language to initialize ocr reader"""
-        try:
-            with open(self.file_path, 'rb') as file:
-                sample_text = file.read(1024)  # read the first 1kB content to detect language
-            detected_lang = langdetect.detect(sample_text.decode('utf-8', errors='ignore'))
-            
-            if detected_lang == 'zh-cn' or detected_lang == 'zh-tw':
-                return 'ch'  
-            elif detected_lang in ['en', 'de']:
-                return detected_lang
-            else:
-                return 'de'
-            
-        except:
-            return 'de'  
+    def _memo_key(self):
+        if self._file_hash is None:
+            self._file_hash = ResultCache.file_hash(self.file_path)
+        return self._file_hash
+
+    def _remembered_language(self, page_index):
+        with _language_memo_lock:
+            pages = _language_memo.get(self._memo_key())
+            if pages is not None:
+                _language_memo.move_to_end(self._memo_key())
+                return pages.get(page_index)
+        return None
+
+    def _remember_language(self, page_index, language):
+        self.page_languages[page_index] = language
+        with _language_memo_lock:
+            _language_memo.setdefault(self._memo_key(), {})[page_index] = language
+            _language_memo.move_to_end(self._memo_key())
+            while len(_language_memo) > LANGUAGE_MEMO_SIZE:
+                _language_memo.popitem(last=False)
+        
+    def detect_language(self, page_index, image):
+        """
+        Language for the OCR of a page without text layer. A page of this file
+        read before takes its language from the memo, every other page is probed
+        on a low resolution copy with a multi-language reader, so a scan that
+        changes language halfway gets the right reader for each page.
+        The language of the previous page only decides when the probe finds too little text.
+        """
+        language = self._remembered_language(page_index)
+        if language is None:
+            start = time.perf_counter()
+            scale = PROBE_MAX_SIDE / max(image.shape[:2])
+            probe = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image
+            probe_text = get_ocr_batcher().read_many([(PROBE_LANGUAGES, probe)])[0]
+            language = to_ocr_language(probe_text) or self.language or DEFAULT_LANGUAGE
+            self.timings["language_seconds"] += time.perf_counter() - start
+            self.timings["probe_pages"] += 1
+        self.language = language
+        self._remember_language(page_index, language)
+        return language
+
+    def ocr(self, page_index, image):
+        """read an image with the reader for its language"""
+        language = self.detect_language(page_index, image)
+        return self.ocr_pages([(page_index, language, image)])[page_index]
+
+    def ocr_pages(self, images):
+        """
+        Read several images in one go through the OCR batcher of the process,
+        so pages of the same size share a model pass.
+        :param images: list of (page index, language, image)
+        :return: dict page index -> text
+        """
+        requests = [(language, image) for _, language, image in images]
+        start = time.perf_counter()
+        texts = get_ocr_batcher().read_many(requests)
+        seconds = time.perf_counter() - start
+        self.timings["ocr_seconds"] += seconds
+        self.timings["ocr_pages"] += len(images)
+        # a batch is one model pass, its time is shared among its pages
+        self.timings["ocr_page_seconds"].extend([seconds / len(images)] * len(images))
+        return {page_index: text for (page_index, _, _), text in zip(images, texts)}
+
+    def prepare(self, image, kind):
+        """
+        preprocess an image for OCR
+        :return: the image to read, None for a blank page
+        """
+        if self.preprocessor is None:
+            return image
+        return self.preprocessor.process(image, kind)
+
+    def _log_timings(self):
+        if self.preprocessor is not None and self.preprocessor.stats["images"]:
+            self.timings.update(self.preprocessor.stats)
+            self.timings["ocr_seconds_saved"] = estimate_saved_seconds(self.timings)
+            logging.info(f"preprocessed {self.timings['images']} images, {self.timings['blank_pages']} blank, "
+                         f"{self.timings['pixels_in'] / 1e6:.1f} -> {self.timings['pixels_out'] / 1e6:.1f} megapixel, "
+                         f"about {self.timings['ocr_seconds_saved']:.2f}s OCR saved")
+        if self.timings["ocr_pages"]:
+            logging.info(f"language probe {self.timings['language_seconds']:.2f}s for {self.timings['probe_pages']} pages, "
+                         f"OCR {self.timings['ocr_seconds']:.2f}s for {self.timings['ocr_pages']} pages, "
+                         f"languages {self.page_languages}")
     
     def extract_text_from_pdf(self):
-        """extract text from pdf"""
-        text = ""
-        with open(self.file_path, 'rb') as file:
-            # get the page num
-            pdf_reader = PyPDF2.PdfReader(file)
-            num_pages = len(pdf_reader.pages)
-        
-            # process every page
-            for page_num in range(num_pages):
-                # extract every page
-                page = pdf_reader.pages[page_num]
-                page_text = page.extract_text()
-
-                # if not sucess with PyPDF2
-                if not page_text.strip():
-                    
-                    # transfer page to image using OCR
-                    pdf_document = fitz.open(self.file_path)
-                    page_image = pdf_document[page_num].get_pixmap()  # get image
-                    
-                    # use tempfile create temp file
-                    with tempfile.NamedTemporaryFile(delete=True, suffix='.png', dir=self.temp) as temp_img:
-                        img_path = temp_img.name  # get the temp path
-                        page_image.save(img_path)  # save image in temp file
-                        # use easyOCR to read
-                        ocr_result = self.OCR_reader.readtext(img_path, detail=0)
-                        page_text = " ".join(ocr_result)
-                
-            text += page_text + "\n"
-        
-        return text.strip()
+        """
+        extract text from pdf, pages are separated by a form feed.
+        The document is opened once, every page uses its text layer if it has
+        one and is rendered to memory and read with OCR otherwise.
+        Scanned pages are collected and read in batches of the batcher size,
+        which also bounds the number of rendered pages held in memory. The batch
+        is shared with the other documents the process extracts at the same time.
+        """
+        pages = []
+        scanned = []   # (page index, language, image) waiting for OCR
+        batcher = get_ocr_batcher()
+        with batcher.producer():
+            with _fitz_lock:
+                pdf_document = fitz.open(self.file_path)
+            try:
+                for page_index in range(pdf_document.page_count):
+                    with _fitz_lock:
+                        page = pdf_document[page_index]
+                        start = time.perf_counter()
+                        page_text = page.get_text()
+                        self.timings["text_layer_seconds"] += time.perf_counter() - start
+                        # no text layer, scanned page, read later together with the others
+                        rendered = self.render_page(page) if not page_text.strip() else None
+                    self.timings["pages"] += 1
+
+                    if rendered is None:
+                        # the text layer is the fallback for a scanned page after it whose probe is inconclusive
+                        start = time.perf_counter()
+                        self.language = to_ocr_language(page_text) or self.language
+                        self.timings["language_seconds"] += time.perf_counter() - start
+                    else:
+                        image = self.prepare(rendered, "scan")
+                        if image is not None:
+                            scanned.append((page_index, self.detect_language(page_index, image), image))
+
+                    pages.append(page_text.strip())
+                    if len(scanned) >= batcher.batch_size:
+                        self._fill_pages(pages, scanned)
+                        scanned = []
+            finally:
+                with _fitz_lock:
+                    pdf_document.close()
+
+            self._fill_pages(pages, scanned)
+        self._log_timings()
+        return PAGE_SEPARATOR.join(pages).strip()
+
+    def _fill_pages(self, pages, scanned):
+        """OCR the collected scanned pages and put their text at their place"""
+        if not scanned:
+            return
+        for page_index, text in self.ocr_pages(scanned).items():
+            pages[page_index] = text.strip()
+
+    def render_page(self, page):
+        """render a pdf page to a numpy array which easyocr reads directly"""
+        colorspace = fitz.csGRAY if self.grayscale else fitz.csRGB
+        pixmap = page.get_pixmap(dpi=self.dpi, colorspace=colorspace, alpha=False)
+        image = np.frombuffer(pixmap.samples, dtype=np.uint8)
+        if pixmap.n == 1:
+            return image.reshape(pixmap.height, pixmap.width)
+        return image.reshape(pixmap.height, pixmap.width, pixmap.n)
     
     def extract_text_from_image(self):
-        ocr_result = self.OCR_reader.readtext(self.file_path, detail=0)
-        text = " ".join(ocr_result)
+        image = cv2.imread(self.file_path, cv2.IMREAD_GRAYSCALE if self.grayscale else cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"can not read image {self.file_path}")
+        self.timings["pages"] = 1
+        with get_ocr_batcher().producer():
+            image = self.prepare(image, source_type(self.file_path))
+            text = self.ocr(0, image) if image is not None else ""
+        self._log_timings()
         return text.strip()
     
     def extract_text_from_txt(self):
@@ -74,4 +233,4 @@ class TextExtractor:
                 text = file.read()
             return text.strip()
         except:
-            return ""
\ No newline at end of file
+            return ""
@@ -0,0 +1,181 @@
+import time
+import queue
+import pickle
+import signal
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+# Light module on purpose like Handlers: the spawned workers import it before
+# they know which task they run.
+
+CHECK_INTERVAL = 1.0   # seconds between the liveness checks of the worker processes
+
+
+def _dumps(value):
+    """pickle a result, an error that can not be pickled is sent as its text"""
+    try:
+        return pickle.dumps(value)
+    except Exception as e:
+        task_id = value[0]
+        return pickle.dumps((task_id, None, RuntimeError(f"result can not be sent back: {e!r}")))
+
+
+def _worker_main(tasks, results, threads, initializer, initargs):
+    """main of a worker process, runs the tasks of its queue on several threads"""
+    # Ctrl-C reaches the whole process group, the parent decides when the workers stop
+    # and lets them finish the documents in flight first
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except Exception:
+            logging.exception("worker initializer failed")
+
+    def run():
+        while True:
+            payload = tasks.get()
+            if payload is None:
+                break
+            task_id, function, args = pickle.loads(payload)
+            try:
+                outcome = (task_id, function(*args), None)
+            except BaseException as e:
+                outcome = (task_id, None, e)
+            results.put(_dumps(outcome))
+
+    runners = [threading.Thread(target=run, name=f"task-{i}") for i in range(threads)]
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+
+
+class _Worker:
+    """one worker process with its own task queue and the ids of the tasks it holds"""
+
+    def __init__(self, context, results, threads, initializer, initargs):
+        self.tasks = context.Queue()
+        self.pending = set()
+        self.process = context.Process(target=_worker_main, daemon=True,
+                                       args=(self.tasks, results, threads, initializer, initargs))
+        self.process.start()
+
+
+class ThreadedProcessPool:
+    """
+    Process pool whose workers run several tasks at the same time on threads,
+    with the submit and shutdown of concurrent.futures.ProcessPoolExecutor.
+    ProcessPoolExecutor runs one task per process at a time, here every worker
+    extracts several documents at once, so the OCR batcher of the process gets
+    the scanned pages of all of them. A task goes to the worker with the fewest
+    tasks, a worker that dies fails its tasks with BrokenProcessPool and is replaced.
+    """
+
+    def __init__(self, processes, threads=1, initializer=None, initargs=(), mp_context=None):
+        """
+        :param processes: number of worker processes
+        :param threads: tasks every process runs at the same time
+        :param initializer: called in every worker process when it starts, an error is only logged
+        :param initargs: arguments of initializer
+        :param mp_context: multiprocessing context, defaults to spawn
+        """
+        self.context = mp_context or multiprocessing.get_context("spawn")
+        self.threads = threads
+        self.initializer = initializer
+        self.initargs = initargs
+        self.results = self.context.Queue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._futures = {}   # task id -> (worker, future)
+        self._shutdown = False
+        self._workers = [self._spawn() for _ in range(processes)]
+        self._collector = threading.Thread(target=self._collect, name="pool-results", daemon=True)
+        self._collector.start()
+
+    def _spawn(self):
+        return _Worker(self.context, self.results, self.threads, self.initializer, self.initargs)
+
+    def submit(self, function, *args):
+        """
+        :param function: module level function, it is pickled by reference
+        :return: Future of the result
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new tasks after shutdown")
+            task_id = next(self._ids)
+            # pickled here, so a task that can not be sent fails in the caller instead of getting lost
+            payload = pickle.dumps((task_id, function, args))
+            worker = min(self._workers, key=lambda candidate: len(candidate.pending))
+            worker.pending.add(task_id)
+            self._futures[task_id] = (worker, future)
+            worker.tasks.put(payload)
+        return future
+
+    def _collect(self):
+        """hand the results of the workers to their futures and watch for dead workers"""
+        next_check = time.monotonic() + CHECK_INTERVAL
+        while True:
+            try:
+                payload = self.results.get(timeout=CHECK_INTERVAL)
+            except queue.Empty:
+                payload = False
+            if payload is None:
+                break
+            if payload is not False:
+                task_id, result, error = pickle.loads(payload)
+                with self._lock:
+                    worker, future = self._futures.pop(task_id, (None, None))
+                    if worker is not None:
+                        worker.pending.discard(task_id)
+                if future is not None:
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+            if time.monotonic() >= next_check:
+                self._replace_dead_workers()
+                next_check = time.monotonic() + CHECK_INTERVAL
+
+    def _replace_dead_workers(self):
+        lost = []
+        with self._lock:
+            if self._shutdown:
+                return
+            for index, worker in enumerate(self._workers):
+                if worker.process.exitcode is None:
+                    continue
+                logging.error(f"worker {worker.process.pid} died with exit code {worker.process.exitcode}, "
+                              f"{len(worker.pending)} tasks lost, starting a new one")
+                lost += [self._futures.pop(task_id)[1] for task_id in worker.pending]
+                self._workers[index] = self._spawn()
+        for future in lost:
+            future.set_exception(BrokenProcessPool("the worker process running the task died"))
+
+    def shutdown(self, wait=True):
+        """let the workers finish the submitted tasks and stop them"""
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            workers = list(self._workers)
+        for worker in workers:
+            for _ in range(self.threads):
+                worker.tasks.put(None)
+        if not wait:
+            return
+        for worker in workers:
+            worker.process.join()
+        # the workers flushed their results before they exited, the collector stops behind them
+        self.results.put(None)
+        self._collector.join()
+        with self._lock:
+            lost = [future for _, future in self._futures.values()]
+            self._futures.clear()
+        for future in lost:
+            future.set_exception(BrokenProcessPool("the pool was shut down while the task was running"))
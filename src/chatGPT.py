@@ -1,4 +1,21 @@
-from openai import OpenAI
+import time
+import random
+import asyncio
+import logging
+import threading
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+from Chunker import TextChunker
+from Handlers import PAGE_SEPARATOR
+from DocumentSchema import (DocumentSummary, BankInfo, Amount, SummaryValidationError,
+                            parse_summary, response_format)
+
+MODEL = "ft:gpt-4o-mini-2024-07-18:personal::ADQS8DsH"
+SYSTEM_PROMPT = "You are a helpful home assistant."
+EXPECTED_COMPLETION_TOKENS = 600   # typical answer size, reserved in the tokens per minute limit
+MISSING = (None, "", "N/A", "None")
+CORRECTION_PROMPT = "You correct JSON documents. Answer only with the corrected JSON object."
 
 class AIAssistant:
     
@@ -11,11 +28,273 @@ class AIAssistant:
         text_to_send = text[:self.max_tokens - 50]  # leave some space before the end
         
         completion = self.client.chat.completions.create(
-            model="ft:gpt-4o-mini-2024-07-18:personal::ADQS8DsH",
+            model=MODEL,
             messages=[
-                {"role": "system", "content": "You are a helpful home assistant."},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": f"{text_to_send}"}
             ]
         )
         
-        return completion.choices[0].message.content
\ No newline at end of file
+        return completion.choices[0].message.content
+
+
+def _first(values):
+    return next((value for value in values if value not in MISSING), "N/A")
+
+
+def merge_summaries(summaries):
+    """
+    Merge the validated answers for the chunks of one document into one record.
+    Single values come from the first chunk that has them, the summaries are
+    joined and people and recipients are collected without duplicates.
+    :param summaries: list of DocumentSummary
+    :return: DocumentSummary
+    """
+    merged = {key: _first(getattr(summary, key) for summary in summaries)
+              for key in ("title", "reference_number", "language", "timestamp")}
+    merged["summary"] = " ".join(summary.summary for summary in summaries if summary.summary not in MISSING) or "N/A"
+
+    bank_infos = [summary.bank_info for summary in summaries]
+    bank_info = {key: _first(getattr(info, key) for info in bank_infos)
+                 for key in ("bank_name", "account_number", "account_holder", "transfer_deadline")}
+    bank_info["amount"] = next((info.amount for info in bank_infos if info.amount.value not in MISSING), Amount())
+
+    people = {}
+    recipients = {}
+    for summary in summaries:
+        for person in summary.related_companies_or_people:
+            people.setdefault((person.name, person.company), person)
+        for recipient in summary.recipients:
+            recipients.setdefault((recipient.name, recipient.email), recipient)
+    return DocumentSummary(**merged, bank_info=BankInfo(**bank_info),
+                           related_companies_or_people=list(people.values()), recipients=list(recipients.values()))
+
+
+class TokenBucket:
+    """
+    Rate limiter for asyncio, the bucket holds up to per_minute units and
+    refills continuously.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        """wait until amount units are available and take them"""
+        amount = min(float(amount), self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class SummaryService:
+    """
+    Long-lived asyncio summarization service.
+    One pooled AsyncOpenAI client runs on its own event loop thread, requests
+    are limited by concurrency and by requests and tokens per minute, and
+    429/5xx answers, timeouts and connection errors are retried with
+    exponential backoff.
+    """
+
+    RETRY_STATUS = (408, 409, 429)
+
+    def __init__(self, key, base_url=None, model=MODEL, max_concurrency=8,
+                 requests_per_minute=500, tokens_per_minute=200000,
+                 timeout=60.0, max_retries=5, backoff_base=1.0, backoff_max=30.0, max_chunk_tokens=4000,
+                 structured_output=True):
+        """
+        :param key: OpenAI api key
+        :param base_url: alternative endpoint, e.g. a local mock server
+        :param model: model used for the summaries
+        :param max_concurrency: maximum number of requests in flight
+        :param requests_per_minute: request rate limit
+        :param tokens_per_minute: token rate limit, prompt and completion
+        :param timeout: seconds per request attempt
+        :param max_retries: retries after the first attempt
+        :param backoff_base: first backoff delay in seconds, doubled per retry
+        :param backoff_max: upper bound of a backoff delay
+        :param max_chunk_tokens: longer documents are split and summarized chunk by chunk
+        :param structured_output: ask for the DocumentSummary json schema, for endpoints that support it
+        """
+        self.key = key
+        self.base_url = base_url
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.chunker = TextChunker(max_chunk_tokens=max_chunk_tokens)
+        self.structured_output = structured_output
+
+        self.loop = None
+        self.client = None
+        self._thread = None
+        self._started = threading.Event()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.corrections = 0
+
+    def start(self):
+        """start the event loop thread and create the pooled client on it"""
+        if self._thread:
+            return
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="llm-loop", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._setup())
+        self._started.set()
+        self.loop.run_forever()
+
+    async def _setup(self):
+        # the limiter primitives have to be created on the loop they are used on
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.request_bucket = TokenBucket(self.requests_per_minute)
+        self.token_bucket = TokenBucket(self.tokens_per_minute)
+        http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=self.max_concurrency,
+                                                            max_keepalive_connections=self.max_concurrency))
+        # retries are done here, so they share the rate limits
+        self.client = AsyncOpenAI(api_key=self.key, base_url=self.base_url, timeout=self.timeout,
+                                  max_retries=0, http_client=http_client)
+
+    def close(self):
+        """close the client and stop the loop thread"""
+        if not self._thread:
+            return
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self._thread = None
+
+    def submit(self, text):
+        """schedule a summary from any thread, returns a concurrent.futures.Future of (DocumentSummary, usage)"""
+        if not self._thread:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(self.summarize_async(text), self.loop)
+
+    def summarize(self, text):
+        """blocking summary for worker threads, json like AIAssistant.JsonFormatSummary but validated"""
+        return self.submit(text).result()[0].model_dump_json()
+
+    def summarize_document(self, text):
+        """
+        blocking summary for worker threads
+        :return: (DocumentSummary, usage) where usage holds chunks, pages, tokens and latency
+        :raises SummaryValidationError: if an answer stays invalid after the correction request
+        """
+        return self.submit(text).result()
+
+    async def summarize_async(self, text):
+        """
+        Map: every chunk of the text is summarized concurrently.
+        Reduce: the validated chunk answers are merged into one record.
+        """
+        start = time.perf_counter()
+        chunks = self.chunker.split(text)
+        results = await asyncio.gather(*(self._summarize_chunk(chunk) for chunk in chunks))
+
+        summaries = [summary for summary, _ in results]
+        completions = [completion for _, chunk_completions in results for completion in chunk_completions]
+        summary = summaries[0] if len(summaries) == 1 else merge_summaries(summaries)
+
+        usage = {
+            "chunks": len(chunks),
+            "pages": text.count(PAGE_SEPARATOR) + 1,
+            "prompt_tokens": sum(completion.usage.prompt_tokens for completion in completions if completion.usage),
+            "completion_tokens": sum(completion.usage.completion_tokens for completion in completions if completion.usage),
+            "latency_seconds": time.perf_counter() - start,
+        }
+        return summary, usage
+
+    def _format_kwargs(self):
+        return {"response_format": response_format()} if self.structured_output else {}
+
+    async def _summarize_chunk(self, chunk):
+        """
+        Summarize and validate one chunk. An invalid answer gets one correction
+        request which only carries the answer and the errors, not the chunk again.
+        :return: (DocumentSummary, list of the completions)
+        """
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"{chunk}"}
+        ]
+        completion = await self.complete(messages, self.chunker.count(chunk) + EXPECTED_COMPLETION_TOKENS,
+                                         **self._format_kwargs())
+        answer = completion.choices[0].message.content or ""
+        try:
+            return parse_summary(answer), [completion]
+        except SummaryValidationError as e:
+            error = e
+        logging.warning(f"invalid summary ({error}), asking for a correction")
+
+        self.corrections += 1
+        messages = [
+            {"role": "system", "content": CORRECTION_PROMPT},
+            {"role": "user", "content": f"Errors: {error}\n\nJSON:\n{answer}"}
+        ]
+        correction = await self.complete(messages, self.chunker.count(answer) + EXPECTED_COMPLETION_TOKENS,
+                                         **self._format_kwargs())
+        try:
+            return parse_summary(correction.choices[0].message.content or ""), [completion, correction]
+        except SummaryValidationError as e:
+            # keep the paid answer in the log, the job is retried later
+            logging.error(f"summary still invalid after correction ({e}): {answer!r}")
+            raise
+
+    async def complete(self, messages, estimated_tokens, **kwargs):
+        """one chat completion with rate limiting, timeout and retries"""
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.request_bucket.acquire(1)
+                await self.token_bucket.acquire(estimated_tokens)
+                self.requests += 1
+                try:
+                    return await asyncio.wait_for(
+                        self.client.chat.completions.create(model=self.model, messages=messages, **kwargs),
+                        timeout=self.timeout)
+                except Exception as e:
+                    retry_after = self._retry_after(e)
+                    if retry_after is None or attempt == self.max_retries:
+                        self.failures += 1
+                        raise
+                    delay = max(retry_after, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                    # jitter, so parallel requests do not retry in lockstep, only upwards: a wait
+                    # shorter than the Retry-After of the server would earn another 429
+                    delay *= random.uniform(1.0, 1.2)
+                    self.retries += 1
+                    logging.warning(f"LLM request failed ({e.__class__.__name__}), retry {attempt + 1} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    def _retry_after(self, error):
+        """
+        :return: minimum delay before a retry, None if the error is not retryable
+        """
+        if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError, openai.APIConnectionError)):
+            return 0.0
+        if isinstance(error, openai.APIStatusError):
+            if error.status_code in self.RETRY_STATUS or error.status_code >= 500:
+                try:
+                    return float(error.response.headers.get("retry-after", 0))
+                except ValueError:
+                    return 0.0
+        return None
+
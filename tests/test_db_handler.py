@@ -0,0 +1,55 @@
+import sqlite3
+
+import pytest
+
+from Database.DBHandler import DatabaseManager, amount_cents
+
+
+def summary(value, currency="EUR"):
+    return {"title": f"invoice {value}", "summary": "", "reference_number": "N/A", "language": "German",
+            "timestamp": "08-10-2024", "bank_info": {"amount": {"currency": currency, "value": value}}}
+
+
+@pytest.fixture
+def db(tmp_path):
+    manager = DatabaseManager(str(tmp_path))
+    manager.connect()
+    yield manager
+    manager.close()
+
+
+@pytest.mark.parametrize("value, cents", [
+    (150.08, 15008), (150, 15000), ("150.08", 15008), ("150,08", 15008), ("1.234,56 €", 123456),
+    ("1,234.56", 123456), ("1.234", 123400), ("1,234", 123400), ("EUR 2.500,00", 250000), ("150,-", 15000),
+    ("-12,50", -1250), ("N/A", None), ("", None), (None, None), (True, None),
+])
+def test_amount_cents(value, cents):
+    assert amount_cents(value) == cents
+
+
+def test_find_by_amount_reads_german_amounts(db):
+    ids = [db.insert_new_element(summary(value), f"/archive/{i}.pdf")
+           for i, value in enumerate(["1.234,56", "150,08", 99.5, "N/A"])]
+
+    def found(**bounds):
+        return sorted(item["id"] for item in db.find_by_amount(**bounds)["items"])
+
+    assert found(min_value=1000) == [ids[0]]
+    assert found(min_value=100, max_value=200) == [ids[1]]
+    assert found(max_value=150.08) == sorted(ids[1:3])
+
+
+def test_migration_fills_value_cents(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "Documents.db"))
+    connection.executescript("""
+    CREATE TABLE amount (id INTEGER PRIMARY KEY, currency VARCHAR(10), value VARCHAR(50), bank_info_id INT);
+    CREATE INDEX idx_amount_value ON amount(CAST(value AS REAL));
+    INSERT INTO amount (currency, value, bank_info_id) VALUES ('EUR', '1.234,56', 1), ('EUR', 'N/A', 2);
+    """)
+    connection.close()
+    manager = DatabaseManager(str(tmp_path))
+    manager.connect()
+    assert manager.connection.execute("SELECT value_cents FROM amount ORDER BY id;").fetchall() == [(123456,), (None,)]
+    indexes = {row[1] for row in manager.connection.execute("PRAGMA index_list(amount);")}
+    assert "idx_amount_value" not in indexes and "idx_amount_value_cents" in indexes
+    manager.close()
@@ -0,0 +1,45 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from Database.DBHandler import amount_cents
+from Database.Export import parse_amounts, parse_currencies, parse_dates
+
+AMOUNTS = [
+    ("150.08", 15008), (150.08, 15008), ("150,08", 15008), ("1.234,56 €", 123456), ("1,234.56", 123456),
+    ("1.234", 123400), ("1,234", 123400), ("1'234.50", 123450), ("150,-", 15000), ("-12,50", -1250),
+    ("ca. 150", 15000), ("EUR 2.500,00", 250000), ("Fr. 99.90", 9990), ("approx. € 12", 1200),
+    (".150", None), ("ca..150", None), ("N/A", None), ("", None), (None, None),
+]
+
+
+def test_parse_amounts():
+    values = pd.Series([value for value, _ in AMOUNTS], dtype="object")
+    cents = parse_amounts(values)
+    assert str(cents.dtype) == "Int64"
+    assert [None if pd.isna(value) else int(value) for value in cents] == [expected for _, expected in AMOUNTS]
+
+
+@pytest.mark.parametrize("value, cents", AMOUNTS)
+def test_amount_cents_reads_like_parse_amounts(value, cents):
+    # find_by_amount filters on the column amount_cents fills, it has to agree with the export
+    assert amount_cents(value) == cents
+
+
+def test_parse_dates():
+    values = pd.Series(["16-10-2024", "16.10.2024", "2024-10-16", "6/1/2024", "16-10-2024 12:00", "N/A", None])
+    dates = parse_dates(values)
+    expected = ["2024-10-16", "2024-10-16", "2024-10-16", "2024-01-06", "2024-10-16", None, None]
+    assert [None if pd.isna(date) else date.strftime("%Y-%m-%d") for date in dates] == expected
+
+
+def test_parse_dates_rejects_impossible_dates():
+    assert parse_dates(pd.Series(["31-02-2024", "2024-13-01"])).isna().all()
+
+
+def test_parse_currencies():
+    currencies = pd.Series(["EUR", " eur", "€", "Euro", "sfr.", "RMB", "N/A", None, "dollars"])
+    amounts = pd.Series(["1", "1", "1", "1", "1", "1", "€ 5", "$5", "5"])
+    expected = ["EUR", "EUR", "EUR", "EUR", "CHF", "CNY", "EUR", "USD", None]
+    result = parse_currencies(currencies, amounts)
+    assert [None if pd.isna(code) else code for code in result] == expected
@@ -0,0 +1,145 @@
+import os
+import time
+import socket
+import hashlib
+
+import pytest
+
+from Database.DBHandler import DatabaseManager
+from Database.JobQueue import JobQueue
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    manager = DatabaseManager(str(tmp_path))
+    manager.connect()
+    manager.close()
+    return str(tmp_path)
+
+
+@pytest.fixture
+def jobs(db_path):
+    queue = JobQueue(db_path, lease_seconds=60, max_attempts=2)
+    queue.connect()
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def scan(tmp_path):
+    path = tmp_path / "scan.pdf"
+    path.write_bytes(b"first scan")
+    return str(path)
+
+
+def state(jobs, job_id):
+    return jobs.connection.execute("SELECT state, attempts FROM jobs WHERE id = ?;", (job_id,)).fetchone()
+
+
+def expire(jobs, job_id):
+    jobs.connection.execute("UPDATE jobs SET lease_expires = ? WHERE id = ?;", (time.time() - 1, job_id))
+    jobs.connection.commit()
+
+
+def test_enqueue_reuses_the_active_job(jobs, scan):
+    job_id = jobs.enqueue(scan)
+    assert jobs.enqueue(scan) == job_id
+    assert jobs.counts() == {"queued": 1}
+
+
+def test_lease_counts_attempts_and_skips_live_leases(jobs, scan):
+    job_id = jobs.enqueue(scan)
+    assert [row["id"] for row in jobs.lease()] == [job_id]
+    assert tuple(state(jobs, job_id)) == ("queued", 1)
+    # a live lease is not taken again, also not by the same owner
+    assert jobs.lease() == []
+    expire(jobs, job_id)
+    assert [row["id"] for row in jobs.lease()] == [job_id]
+    assert tuple(state(jobs, job_id)) == ("queued", 2)
+
+
+def test_expired_lease_fails_after_max_attempts(jobs, scan):
+    job_id = jobs.enqueue(scan)
+    for _ in range(2):
+        assert jobs.lease(job_id=job_id)
+        expire(jobs, job_id)
+    assert jobs.lease(job_id=job_id) == []
+    assert state(jobs, job_id)["state"] == "failed"
+
+
+def test_fail_retries_until_final(jobs, scan):
+    job_id = jobs.enqueue(scan)
+    jobs.lease(job_id=job_id)
+    jobs.fail(job_id, "timeout")
+    assert state(jobs, job_id)["state"] == "queued"
+    assert jobs.lease(job_id=job_id)
+    jobs.fail(job_id, "empty", final=True)
+    assert state(jobs, job_id)["state"] == "failed"
+
+
+def test_checkpoint_and_finish(jobs, scan):
+    job_id = jobs.enqueue(scan)
+    jobs.lease(job_id=job_id)
+    jobs.checkpoint(job_id, "extracted", extracted_text="text")
+    row = jobs.connection.execute("SELECT state, extracted_text FROM jobs WHERE id = ?;", (job_id,)).fetchone()
+    assert tuple(row) == ("extracted", "text")
+    jobs.finish(job_id)
+    assert state(jobs, job_id)["state"] == "moved"
+    # the path holds a new file after the old one was moved
+    assert jobs.enqueue(scan) != job_id
+
+
+def test_failed_file_is_not_processed_again(jobs, scan):
+    job_id = jobs.enqueue(scan)
+    jobs.lease(job_id=job_id)
+    jobs.fail(job_id, "empty", final=True)
+    assert jobs.enqueue(scan) == job_id
+    assert jobs.lease(job_id=job_id) == []
+    assert jobs.enqueue(scan, retry_failed=True) != job_id
+
+
+def test_changed_file_under_the_same_path_gets_a_new_job(jobs, scan):
+    job_id = jobs.enqueue(scan)
+    jobs.lease(job_id=job_id)
+    jobs.fail(job_id, "empty", final=True)
+    with open(scan, "wb") as file:
+        file.write(b"corrected scan")
+    os.utime(scan, (time.time() + 10, time.time() + 10))
+    new_id = jobs.enqueue(scan)
+    assert new_id != job_id
+    assert [row["id"] for row in jobs.lease(job_id=new_id)] == [new_id]
+
+
+def test_touched_file_with_the_same_content_stays_failed(jobs, scan):
+    job_id = jobs.enqueue(scan)
+    jobs.lease(job_id=job_id)
+    jobs.checkpoint(job_id, "queued", file_hash=hashlib.sha256(b"first scan").hexdigest())
+    jobs.fail(job_id, "empty", final=True)
+    os.utime(scan, (time.time() + 10, time.time() + 10))
+    assert jobs.enqueue(scan) == job_id
+
+
+def test_lease_takes_over_jobs_of_a_dead_process(db_path, jobs, scan):
+    # above the largest pid of linux, so no process of this host has it
+    dead = JobQueue(db_path, owner=f"{socket.gethostname()}:{2 ** 22 + 1}")
+    dead.connect()
+    job_id = dead.enqueue(scan)
+    dead.lease()
+    dead.close()
+    assert [row["id"] for row in jobs.lease()] == [job_id]
+
+
+def test_renew_keeps_own_leases_alive(db_path, jobs, scan):
+    job_id = jobs.enqueue(scan)
+    jobs.lease(job_id=job_id)
+    expire(jobs, job_id)
+    jobs.renew([job_id])
+    assert jobs.lease() == []
+    assert state(jobs, job_id)["attempts"] == 1
+    # a lease of another owner is not renewed
+    other = JobQueue(db_path, owner="other:1")
+    other.connect()
+    expire(jobs, job_id)
+    other.renew([job_id])
+    other.close()
+    assert [row["id"] for row in jobs.lease()] == [job_id]
@@ -0,0 +1,37 @@
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+np = pytest.importorskip("numpy")
+
+from Preprocess import ImagePreprocessor
+
+
+@pytest.fixture(scope="module")
+def page():
+    """white page with 30 lines of random words, a logo block, a stamp and a dark corner"""
+    page = np.full((2200, 1700), 255, np.uint8)
+    random = np.random.default_rng(0)
+    letters = list("abcdefghijklmnopqrstuvwxyz")
+    for line in range(30):
+        words = " ".join("".join(random.choice(letters, random.integers(2, 9)))
+                         for _ in range(random.integers(3, 9)))
+        cv2.putText(page, words, (150, 300 + line * 55), cv2.FONT_HERSHEY_SIMPLEX, 1.1, 0, 2)
+    cv2.rectangle(page, (1150, 80), (1600, 250), 0, -1)
+    cv2.circle(page, (1350, 1900), 160, 0, 12)
+    cv2.fillPoly(page, [np.array([[100, 2000], [700, 2150], [100, 2150]])], 0)
+    return page
+
+
+@pytest.mark.parametrize("angle", [-14, -8, -3, 0, 3, 8, 14])
+def test_skew_angle_undoes_the_rotation(page, angle):
+    # the logo and the stamp must not pull the estimate away from the text lines
+    ink, _ = ImagePreprocessor._ink_mask(ImagePreprocessor._rotate(page, angle))
+    estimate = ImagePreprocessor._skew_angle(ink)
+    # _rotate by the estimate has to turn the page back
+    assert abs(angle + estimate) <= 0.3
+
+
+def test_skew_angle_needs_text_lines():
+    blank = np.zeros((1000, 800), np.uint8)
+    cv2.circle(blank, (400, 500), 200, 255, 10)
+    assert ImagePreprocessor._skew_angle(blank) == 0.0